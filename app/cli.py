@@ -0,0 +1,551 @@
+"""コマンドライン実行（cron やバッチ処理向け）。
+
+使い方:
+    python -m app.cli sync [--folders 123,456] [--shard KEY ...] [--profile]
+    python -m app.cli ingest-local DIR [--recursive] [--workers N]
+    python -m app.cli compact [--force | --threshold R]
+    python -m app.cli export OUT.tar [--since GEN | --base OLD.tar] [--dtype float16]
+    python -m app.cli import SNAPSHOT.tar
+    python -m app.cli ask "質問" [--profile]
+    python -m app.cli ask-batch questions.csv [--out results.jsonl] [--concurrency N]
+    python -m app.cli bench-pages [--repeat N] [--root DIR] [--importtime]
+    python -m app.cli serve-retrieval [--host 127.0.0.1 --port 8765 | --socket PATH]
+    python -m app.cli bench-retrieval [--concurrency 1,4,16] [--requests N] [--server URL]
+
+進捗は標準エラー、結果（JSON / JSONL）は標準出力またはファイルに書き出す。
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, TextIO, Tuple
+
+from app.core.config import get_settings
+
+
+def _log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+def _print_json(data: Dict[str, Any]) -> None:
+    print(json.dumps(data, ensure_ascii=False))
+
+
+# =============================
+# sync
+# =============================
+def _cmd_sync(args: argparse.Namespace) -> int:
+    from app.core.ingest import sync_box_folders
+
+    folder_ids = args.folders or get_settings().box_folder_ids
+    if not folder_ids:
+        _log("BOX_FOLDER_IDS が未設定です（--folders で指定できます）。")
+        return 2
+
+    def _progress(done: int, total: int, message: str) -> None:
+        _log(f"[{done}/{total}] {message}")
+
+    from app.core.compaction import recent_results, wait_for_compaction
+    from app.core.profiling import profile_run
+
+    started = time.perf_counter()
+    with profile_run("sync", enabled=args.profile or None) as prof:
+        added, updated, deleted, total = sync_box_folders(
+            folder_ids, shards=args.shard or None, on_progress=_progress
+        )
+    if prof.html_path is not None:
+        _log(f"プロファイル: {prof.html_path}")
+    wait_for_compaction()  # バックグラウンドのコンパクションを終えてから終了する
+    _print_json(
+        {
+            "added": added,
+            "updated": updated,
+            "deleted": deleted,
+            "total_vectors": total,
+            "compacted": [r.to_dict() for r in recent_results()],
+            "elapsed_sec": round(time.perf_counter() - started, 3),
+        }
+    )
+    return 0
+
+
+# =============================
+# compact
+# =============================
+def _cmd_compact(args: argparse.Namespace) -> int:
+    from app.core.compaction import compact_index, needs_compaction, tombstone_stats
+    from app.core.shards import index_dirs
+
+    results = []
+    for d in index_dirs():
+        if not args.force and not needs_compaction(d, args.threshold):
+            stats = tombstone_stats(d)
+            _log(f"スキップ: {d}（墓標 {stats['tombstones']} / {stats['vectors']}）")
+            continue
+        _log(f"圧縮中: {d}")
+        result = compact_index(d)
+        if result is not None:
+            results.append(result.to_dict())
+    reclaimed = sum(r["reclaimed_bytes"] for r in results)
+    _print_json({"compacted": results, "reclaimed_bytes": reclaimed})
+    return 0
+
+
+# =============================
+# export / import（スナップショット）
+# =============================
+def _cmd_export(args: argparse.Namespace) -> int:
+    from app.core.snapshot import export_snapshot
+
+    started = time.perf_counter()
+    meta = export_snapshot(args.out, since=args.since, base=args.base, dtype=args.dtype)
+    for entry in meta["indexes"]:
+        _log(
+            f"{entry['name']}: {entry['kind']} 世代 {entry['generation']}"
+            f" / {entry['count']} ベクトル"
+        )
+    _print_json(
+        {
+            "path": args.out,
+            "sha256": meta["sha256"],
+            "bytes": Path(args.out).stat().st_size,
+            "indexes": [
+                {k: e[k] for k in ("name", "kind", "since", "generation", "count", "deleted")}
+                for e in meta["indexes"]
+            ],
+            "elapsed_sec": round(time.perf_counter() - started, 3),
+        }
+    )
+    return 0
+
+
+def _cmd_import(args: argparse.Namespace) -> int:
+    from app.core.snapshot import import_snapshot
+
+    started = time.perf_counter()
+    summary = import_snapshot(args.snapshot)
+    summary["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    _print_json(summary)
+    return 0
+
+
+# =============================
+# ingest-local
+# =============================
+def _parse_pdf(path: str) -> Tuple[str, List[Any]]:
+    from app.core.utils import pdf_bytes_to_documents
+
+    p = Path(path)
+    return p.name, pdf_bytes_to_documents(p.name, p.read_bytes())
+
+
+def _cmd_ingest_local(args: argparse.Namespace) -> int:
+    from app.core.ingest import upsert_documents
+
+    root = Path(args.dir)
+    if not root.is_dir():
+        _log(f"ディレクトリが見つかりません: {root}")
+        return 2
+    pattern = "**/*" if args.recursive else "*"
+    paths = sorted(str(p) for p in root.glob(pattern) if p.is_file() and p.suffix.lower() == ".pdf")
+    if not paths:
+        _log("PDF が見つかりませんでした。")
+        return 1
+
+    started = time.perf_counter()
+    docs: List[Any] = []
+    per_file: Dict[str, int] = {}
+    failed: Dict[str, str] = {}
+    # テキスト抽出は CPU 処理のためプロセス並列
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(_parse_pdf, p): p for p in paths}
+        for done, f in enumerate(as_completed(futures), start=1):
+            path = futures[f]
+            try:
+                name, file_docs = f.result()
+            except Exception as e:
+                failed[path] = str(e)
+                _log(f"[{done}/{len(paths)}] 失敗 {path}: {e}")
+                continue
+            per_file[path] = len(file_docs)
+            docs.extend(file_docs)
+            _log(f"[{done}/{len(paths)}] {name}: {len(file_docs)} チャンク")
+
+    added, total = (0, None)
+    if docs:
+        _log(f"ベクトル化して保存中…（{len(docs)} チャンク）")
+        added, total = upsert_documents(docs)
+    _print_json(
+        {
+            "files": len(paths),
+            "chunks": per_file,
+            "failed": failed,
+            "added": added,
+            "total_vectors": total,
+            "elapsed_sec": round(time.perf_counter() - started, 3),
+        }
+    )
+    return 0 if not failed else 1
+
+
+# =============================
+# ask / ask-batch
+# =============================
+def _cmd_ask(args: argparse.Namespace) -> int:
+    from app.core.profiling import profile_run
+    from app.core.rag import build_chain
+
+    with profile_run("ask", enabled=args.profile or None) as prof:
+        answer = build_chain().invoke(args.question)
+    print(answer)
+    if prof.html_path is not None:
+        _log(f"プロファイル: {prof.html_path}")
+    return 0
+
+
+def _read_questions(path: Path, column: str) -> List[Dict[str, str]]:
+    with path.open(encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    if rows and column not in rows[0]:
+        raise SystemExit(f"CSV に列 '{column}' がありません（--column で指定できます）。")
+    return [r for r in rows if (r.get(column) or "").strip()]
+
+
+def _answer_all(
+    chain: Any, rows: Sequence[Dict[str, str]], column: str, concurrency: int, out: TextIO
+) -> int:
+    """rows の質問を最大 concurrency 並列で回答し、完了順に JSONL で書き出す。失敗件数を返す。"""
+    failures = 0
+
+    def _answer(row: Dict[str, str]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"id": row.get("id"), "query": row[column]}
+        try:
+            record["answer"] = chain.invoke(row[column])
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["elapsed_sec"] = round(time.perf_counter() - started, 3)
+        return record
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ask") as pool:
+        futures = [pool.submit(_answer, row) for row in rows]
+        for done, f in enumerate(as_completed(futures), start=1):
+            record = f.result()
+            if "error" in record:
+                failures += 1
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            _log(f"[{done}/{len(rows)}] {record.get('id') or ''} {record['elapsed_sec']}s")
+    return failures
+
+
+def _cmd_ask_batch(args: argparse.Namespace) -> int:
+    from app.core.rag import build_chain
+
+    rows = _read_questions(Path(args.file), args.column)
+    if not rows:
+        _log("質問がありません。")
+        return 1
+    concurrency = args.concurrency or get_settings().llm_max_concurrency
+    chain = build_chain()  # リトリーバ/LLM は全質問で共有
+
+    started = time.perf_counter()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out:
+            failures = _answer_all(chain, rows, args.column, concurrency, out)
+    else:
+        failures = _answer_all(chain, rows, args.column, concurrency, sys.stdout)
+    _log(
+        f"完了: {len(rows)} 件（失敗 {failures} 件） / 並列数 {concurrency} / "
+        f"{time.perf_counter() - started:.1f}s"
+    )
+    return 0 if failures == 0 else 1
+
+
+# =============================
+# bench-pages
+# =============================
+PAGES: Tuple[Tuple[str, str], ...] = (
+    ("Dashboard", "app/main.py"),
+    ("Q&A", "pages/01_Q_and_A.py"),
+    ("データ取り込み・同期", "pages/02_Ingest_and_Sync.py"),
+    ("Box 管理", "pages/03_Box_Admin.py"),
+)
+
+# 新しいプロセスでページを1回描画し、所要時間（ms）を最終行に出力する。
+# Streamlit のランタイム外（bare モード）で実行するため、ボタン等は未操作として描画される。
+_RENDER_SNIPPET = """
+import runpy, sys, time
+started = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="__main__")
+print("__RENDER_MS__", (time.perf_counter() - started) * 1000)
+"""
+
+
+def _render_page_once(root: Path, page: str, importtime: bool) -> Tuple[float | None, str]:
+    env = dict(os.environ, PYTHONPATH=str(root), WARMUP="false")
+    flags = ["-X", "importtime"] if importtime else []
+    cmd = [sys.executable, *flags, "-c", _RENDER_SNIPPET, page]
+    proc = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("__RENDER_MS__"):
+            return float(line.split()[1]), proc.stderr
+    return None, proc.stderr
+
+
+def _top_imports(stderr: str, limit: int) -> List[Tuple[int, str]]:
+    """-X importtime の出力からトップレベル import を累積時間（µs）の降順で返す。"""
+    rows: List[Tuple[int, str]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not name[1:].startswith(" "):  # 字下げなし = トップレベルの import
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def _cmd_bench_pages(args: argparse.Namespace) -> int:
+    root = Path(args.root).resolve()
+    print("| ページ | 初回描画 中央値 (ms) | 最小 (ms) | 最大 (ms) |")
+    print("|---|---:|---:|---:|")
+    failed = 0
+    for title, page in PAGES:
+        if not (root / page).exists():
+            _log(f"スキップ（見つかりません）: {page}")
+            continue
+        timings: List[float] = []
+        stderr = ""
+        for _ in range(args.repeat):
+            ms, stderr = _render_page_once(root, page, args.importtime)
+            if ms is None:
+                break
+            timings.append(ms)
+        if not timings:
+            failed += 1
+            _log(f"描画に失敗しました: {page}\n{stderr[-2000:]}")
+            print(f"| {title} | 失敗 | - | - |")
+            continue
+        median, fastest, slowest = statistics.median(timings), min(timings), max(timings)
+        print(f"| {title} | {median:,.0f} | {fastest:,.0f} | {slowest:,.0f} |", flush=True)
+        if args.importtime:
+            for cumulative, name in _top_imports(stderr, args.top):
+                _log(f"  {title}: {cumulative / 1000:8.1f} ms  {name}")
+    return 0 if failed == 0 else 1
+
+
+# =============================
+# serve-retrieval / bench-retrieval
+# =============================
+def _cmd_serve_retrieval(args: argparse.Namespace) -> int:
+    import logging
+
+    from app.core.retrieval_server import serve
+
+    logging.basicConfig(
+        level=get_settings().log_level, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    serve(host=args.host, port=args.port, socket_path=args.socket)
+    return 0
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _bench_retrieval_once(
+    search: Any, queries: Sequence[str], concurrency: int, k: int
+) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    def _one(q: str) -> None:
+        started = time.perf_counter()
+        search(q, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+        for f in [pool.submit(_one, q) for q in queries]:
+            f.result()
+    elapsed = time.perf_counter() - started
+    return {
+        "qps": len(queries) / elapsed,
+        "p50": _percentile(latencies, 0.5),
+        "p95": _percentile(latencies, 0.95),
+    }
+
+
+def _cmd_bench_retrieval(args: argparse.Namespace) -> int:
+    from app.core.retrieval_server import RetrievalClient
+    from app.core.shards import index_dirs, load_index, search_documents
+
+    settings = get_settings()
+    rows = _read_questions(Path(args.queries), args.column)
+    if not rows:
+        _log("質問がありません。")
+        return 1
+    queries = [rows[i % len(rows)][args.column] for i in range(args.requests)]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    modes: List[Tuple[str, Any]] = []
+    if not args.server_only:
+        for d in index_dirs():  # ロード時間を計測に含めない
+            load_index(d)
+        modes.append(("プロセス内", search_documents))
+    server = args.server or settings.retrieval_server_url
+    if server:
+        client = RetrievalClient(server)
+        client.health()
+        modes.append(("検索サーバ", client.search_documents))
+    if not modes:
+        _log("計測対象がありません（--server または RETRIEVAL_SERVER_URL を指定してください）。")
+        return 2
+
+    print("| 方式 | 同時実行数 | QPS | p50 (ms) | p95 (ms) |")
+    print("|---|---:|---:|---:|---:|")
+    for name, search in modes:
+        search(queries[0], settings.top_k)  # 接続・初回ロードのウォームアップ
+        for c in levels:
+            r = _bench_retrieval_once(search, queries, c, settings.top_k)
+            row = f"| {name} | {c} | {r['qps']:,.1f} | {r['p50']:,.0f} | {r['p95']:,.0f} |"
+            print(row, flush=True)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.cli", description="Box RAG App のコマンドライン実行"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sync", help="Boxフォルダを再帰的に同期（追加/更新/削除）")
+    p.add_argument("--folders", help="カンマ区切りのフォルダID（既定: BOX_FOLDER_IDS）")
+    p.add_argument("--shard", action="append", help="対象シャードに限定（複数指定可）")
+    p.add_argument(
+        "--profile",
+        action="store_true",
+        help="プロファイルを PROFILES_DIR に保存する（既定: PROFILING）",
+    )
+    p.set_defaults(func=_cmd_sync)
+
+    p = sub.add_parser(
+        "compact", help="墓標（論理削除）の付いたベクトルをインデックスから物理削除する"
+    )
+    p.add_argument(
+        "--force", action="store_true", help="墓標の割合にかかわらず全インデックスを圧縮する"
+    )
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="墓標の割合のしきい値（既定: VECTOR_COMPACT_RATIO）",
+    )
+    p.set_defaults(func=_cmd_compact)
+
+    p = sub.add_parser("export", help="インデックスのスナップショット（tar）を書き出す")
+    p.add_argument("out", help="出力先（例: snapshots/index-20240101.tar）")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--since", type=int, help="この世代より後の変更だけを含む差分にする")
+    group.add_argument(
+        "--base", help="基準スナップショット（インデックスごとの世代からの差分にする）"
+    )
+    p.add_argument(
+        "--dtype",
+        choices=["float32", "float16"],
+        default="float32",
+        help="ベクトルの保存形式（既定: float32）",
+    )
+    p.set_defaults(func=_cmd_export)
+
+    p = sub.add_parser("import", help="スナップショットを再埋め込みなしで取り込む（差分にも対応）")
+    p.add_argument("snapshot", help="スナップショット（tar）")
+    p.set_defaults(func=_cmd_import)
+
+    p = sub.add_parser("ingest-local", help="ローカルディレクトリのPDFを並列に取り込む")
+    p.add_argument("dir", help="PDF を含むディレクトリ")
+    p.add_argument("--recursive", action="store_true", help="サブディレクトリも対象にする")
+    p.add_argument("--workers", type=int, default=None, help="抽出の並列プロセス数（既定: CPU数）")
+    p.set_defaults(func=_cmd_ingest_local)
+
+    p = sub.add_parser("ask", help="質問に1件回答する")
+    p.add_argument("question", help="質問文")
+    p.add_argument(
+        "--profile",
+        action="store_true",
+        help="プロファイルを PROFILES_DIR に保存する（既定: PROFILING）",
+    )
+    p.set_defaults(func=_cmd_ask)
+
+    p = sub.add_parser("ask-batch", help="CSV の質問に並列で回答し JSONL で出力する")
+    p.add_argument("file", help="質問CSV（例: app/prompts/representative_questions.csv）")
+    p.add_argument("--column", default="query", help="質問文の列名（既定: query）")
+    p.add_argument("--out", help="出力先 JSONL（既定: 標準出力）")
+    p.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="LLM の同時実行数（既定: LLM_MAX_CONCURRENCY）",
+    )
+    p.set_defaults(func=_cmd_ask_batch)
+
+    p = sub.add_parser(
+        "bench-pages", help="各ページの初回描画時間を新しいプロセスで計測し、Markdown表で出力する"
+    )
+    p.add_argument("--repeat", type=int, default=5, help="ページごとの計測回数（既定: 5）")
+    p.add_argument(
+        "--root",
+        default=".",
+        help="計測するリポジトリのルート（変更前との比較は git worktree で別ディレクトリを指定）",
+    )
+    p.add_argument(
+        "--importtime",
+        action="store_true",
+        help="-X importtime で重い import を標準エラーに表示する",
+    )
+    p.add_argument("--top", type=int, default=10, help="--importtime で表示する件数（既定: 10）")
+    p.set_defaults(func=_cmd_bench_pages)
+
+    p = sub.add_parser("serve-retrieval", help="インデックスを保持するローカル検索サーバを起動する")
+    p.add_argument("--host", default="127.0.0.1", help="待ち受けアドレス（既定: 127.0.0.1）")
+    p.add_argument("--port", type=int, default=8765, help="待ち受けポート（既定: 8765）")
+    p.add_argument(
+        "--socket", help="TCP の代わりに Unix ソケットで待ち受ける（例: /tmp/box-rag.sock）"
+    )
+    p.set_defaults(func=_cmd_serve_retrieval)
+
+    p = sub.add_parser(
+        "bench-retrieval", help="同時実行数ごとの検索スループットをプロセス内/検索サーバで比較する"
+    )
+    p.add_argument(
+        "--queries",
+        default="app/prompts/representative_questions.csv",
+        help="質問CSV（既定: 代表質問）",
+    )
+    p.add_argument("--column", default="query", help="質問文の列名（既定: query）")
+    p.add_argument(
+        "--concurrency", default="1,2,4,8,16", help="カンマ区切りの同時実行数（既定: 1,2,4,8,16）"
+    )
+    p.add_argument("--requests", type=int, default=64, help="同時実行数ごとのクエリ数（既定: 64）")
+    p.add_argument("--server", help="検索サーバの URL（既定: RETRIEVAL_SERVER_URL）")
+    p.add_argument("--server-only", action="store_true", help="プロセス内検索の計測を省く")
+    p.set_defaults(func=_cmd_bench_retrieval)
+    return parser
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return int(args.func(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
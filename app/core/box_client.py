@@ -0,0 +1,220 @@
+"""プロセス共有の Box クライアント。
+
+- クライアント/認証オブジェクトはプロセス内で1つだけ生成して再利用する
+- CCG のアクセストークンは有効期限までキャッシュし、
+  期限の BOX_TOKEN_REFRESH_MARGIN 秒前にロック下で更新
+- HTTP は keep-alive の接続プール（BOX_HTTP_POOL_SIZE）を共有
+- 429/5xx は boxsdk の再試行機構で BOX_MAX_RETRIES 回まで再試行
+  （Retry-After を優先、なければ指数バックオフ）
+- トークン取得回数・再試行回数・接続の新規作成/再利用数を metrics に記録
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from . import metrics
+from .config import Settings, get_settings
+
+if TYPE_CHECKING:  # pragma: no cover
+    from boxsdk import Client
+
+
+def _import_boxsdk() -> SimpleNamespace:
+    """boxsdk は初回のクライアント生成時に読み込む（ページ表示を重くしないため）。"""
+    try:
+        from boxsdk import Client, OAuth2
+        from boxsdk.auth.ccg_auth import CCGAuth
+        from boxsdk.config import API
+        from boxsdk.network.default_network import DefaultNetwork
+        from boxsdk.session.session import AuthorizedSession, Session
+    except Exception as e:  # pragma: no cover - optional import until Box接続時に使用
+        raise RuntimeError("boxsdk が見つかりません。requirements.txt を確認してください。") from e
+    return SimpleNamespace(
+        Client=Client,
+        OAuth2=OAuth2,
+        CCGAuth=CCGAuth,
+        API=API,
+        DefaultNetwork=DefaultNetwork,
+        AuthorizedSession=AuthorizedSession,
+        Session=Session,
+    )
+
+
+class _TokenCacheMixin:
+    """トークン応答の expires_in を記録し、期限前に先行更新できるようにする。"""
+
+    _expires_at: Optional[float] = None
+    _fresh_lock = threading.Lock()
+
+    def _execute_token_request(self, *args: Any, **kwargs: Any) -> Any:
+        response = super()._execute_token_request(*args, **kwargs)  # type: ignore[misc]
+        metrics.incr("box.token_fetches")
+        try:
+            expires_in = float(response["expires_in"])
+        except Exception:
+            expires_in = None
+        self._expires_at = time.monotonic() + expires_in if expires_in else None
+        return response
+
+    def ensure_fresh(self, margin: float) -> None:
+        """未取得または期限 margin 秒前を過ぎていればトークンを更新する。"""
+        with self._fresh_lock:
+            token = self.access_token  # type: ignore[attr-defined]
+            expires_at = self._expires_at
+            if token is not None and (expires_at is None or time.monotonic() < expires_at - margin):
+                return
+            self.refresh(token)  # type: ignore[attr-defined]
+
+
+class _PooledNetworkMixin:
+    """requests.Session に大きめの keep-alive 接続プールを割り当てる。"""
+
+    def __init__(self, *args: Any, pool_size: int = 16, **kwargs: Any) -> None:
+        from requests.adapters import HTTPAdapter
+
+        super().__init__(*args, **kwargs)
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("https://", self._adapter)  # type: ignore[attr-defined]
+
+    def connection_stats(self) -> Tuple[int, int]:
+        """(新規接続数, リクエスト数) を urllib3 の接続プールから集計する。"""
+        connections = requests_sent = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            connections += getattr(pool, "num_connections", 0)
+            requests_sent += getattr(pool, "num_requests", 0)
+        return connections, requests_sent
+
+
+class _RetryCountingSessionMixin:
+    """boxsdk の再試行（429/5xx）を計数する。待ち時間は Retry-After を優先。
+
+    boxsdk は再試行の直前に ``Session.get_retry_after_time`` で待ち時間を求めるので、
+    その呼び出し回数を再試行回数とする。API 用と認証（トークン取得）用の両方のセッションに使う。
+    """
+
+    def get_retry_after_time(self, attempt_number: int, retry_after_header: Optional[str]) -> float:
+        metrics.incr("box.retries")
+        return super().get_retry_after_time(attempt_number, retry_after_header)  # type: ignore[misc]
+
+
+_client: Optional["Client"] = None
+_client_key: Optional[Tuple[Any, ...]] = None
+_auth: Any = None
+_network: Any = None
+_lock = threading.Lock()
+
+
+def _client_settings_key(settings: Settings) -> Tuple[Any, ...]:
+    return (
+        (settings.box_auth_method or "").lower(),
+        settings.box_client_id,
+        settings.box_developer_token,
+        settings.box_subject_type,
+        settings.box_subject_id,
+    )
+
+
+def _build_auth(settings: Settings, sdk: SimpleNamespace, session: Any = None) -> Any:
+    """認証オブジェクトを作る。session はトークン取得に使うセッション（再試行の計数用）。"""
+    method = (settings.box_auth_method or "").lower()
+    if method == "devtoken":
+        if not settings.box_developer_token:
+            raise RuntimeError("BOX_DEVELOPER_TOKEN を設定してください（開発トークン）。")
+        # Developer Token は短命・更新不可。テスト用途のみ。
+        return sdk.OAuth2(
+            client_id=settings.box_client_id,
+            client_secret=settings.box_client_secret,
+            access_token=settings.box_developer_token,
+            session=session,
+        )
+    elif method == "oauth":  # CCG（Server-side OAuth）
+        auth_cls = type("CachedCCGAuth", (_TokenCacheMixin, sdk.CCGAuth), {})
+        if settings.box_subject_type == "user" and settings.box_subject_id:
+            return auth_cls(
+                client_id=settings.box_client_id,
+                client_secret=settings.box_client_secret,
+                user=settings.box_subject_id,
+                session=session,
+            )
+        elif settings.box_subject_type == "enterprise" and settings.box_subject_id:
+            return auth_cls(
+                client_id=settings.box_client_id,
+                client_secret=settings.box_client_secret,
+                enterprise_id=settings.box_subject_id,
+                session=session,
+            )
+        else:
+            raise RuntimeError(
+                "BOX_SUBJECT_TYPE と BOX_SUBJECT_ID を設定してください（user か enterprise）。"
+            )
+    else:
+        raise RuntimeError(
+            "BOX_AUTH_METHOD は 'oauth'（CCG）または 'devtoken' をサポートしています。"
+            "設定を確認してください。"
+        )
+
+
+def _build_client(settings: Settings) -> Tuple["Client", Any, Any]:
+    sdk = _import_boxsdk()
+    sdk.API.MAX_RETRY_ATTEMPTS = settings.box_max_retries
+    network = type("PooledNetwork", (_PooledNetworkMixin, sdk.DefaultNetwork), {})(
+        pool_size=settings.box_http_pool_size
+    )
+    # CCG のトークン取得は認証オブジェクト内部のセッションで行われるため、そちらも差し替える
+    auth_session = type("RetryCountingAuthSession", (_RetryCountingSessionMixin, sdk.Session), {})(
+        network_layer=network
+    )
+    auth = _build_auth(settings, sdk, session=auth_session)
+    session = type("RetryCountingSession", (_RetryCountingSessionMixin, sdk.AuthorizedSession), {})(
+        auth, network_layer=network
+    )
+    return sdk.Client(auth, session=session), auth, network
+
+
+def get_box_client() -> "Client":
+    """プロセス共有の Box クライアントを返す（必要ならトークンを先行更新）。"""
+    global _client, _client_key, _auth, _network
+    settings = get_settings()
+    key = _client_settings_key(settings)
+    with _lock:
+        if _client is None or _client_key != key:
+            _client, _auth, _network = _build_client(settings)
+            _client_key = key
+            metrics.incr("box.clients_created")
+        else:
+            metrics.incr("box.clients_reused")
+        client, auth = _client, _auth
+    if isinstance(auth, _TokenCacheMixin):
+        auth.ensure_fresh(settings.box_token_refresh_margin)
+    return client
+
+
+def reset_box_client() -> None:
+    """共有クライアントを破棄する（設定変更時など）。"""
+    global _client, _client_key, _auth, _network
+    with _lock:
+        _client = _client_key = _auth = _network = None
+
+
+def box_client_metrics() -> Dict[str, float]:
+    """Box接続関連のメトリクス（トークン取得・再試行・接続再利用など）。"""
+    values = metrics.snapshot("box.")
+    network = _network
+    if network is not None:
+        connections, requests_sent = network.connection_stats()
+        values["box.http_connections"] = connections
+        values["box.http_requests"] = requests_sent
+        values["box.http_connections_reused"] = max(0, requests_sent - connections)
+    return values
+
+
+__all__ = ["get_box_client", "reset_box_client", "box_client_metrics"]
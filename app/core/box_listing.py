@@ -0,0 +1,156 @@
+"""Box フォルダ一覧の TTL キャッシュとマーカー方式のページング。
+
+Streamlit はウィジェット操作のたびにスクリプト全体を再実行するため、一覧取得はここを経由して
+キャッシュを再利用する。キャッシュキーは (folder_id, recursive, fields, ...)。
+アップロードや「再読み込み」時は invalidate_listing() で明示的に破棄する。
+再帰一覧はフォルダ単位の直下一覧キャッシュを組み合わせて作るため、期限切れ/破棄されたフォルダのみ再取得する。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .box_client import get_box_client
+from .config import get_settings
+from .ingest import _normalize_folder_id
+
+ITEM_FIELDS: Tuple[str, ...] = ("id", "type", "name", "modified_at", "size")
+PDF_FIELDS: Tuple[str, ...] = ("id", "type", "name", "sha1", "etag", "modified_at", "size")
+_PAGE_LIMIT = 1000  # Box API の1ページ最大件数
+
+
+class ListingCache:
+    """TTL 付きの一覧キャッシュ（プロセス共有・スレッドセーフ）。"""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._items: Dict[Tuple[Any, ...], Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Any, ...]) -> Any:
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None:
+                return None
+            if hit[0] < time.monotonic():
+                del self._items[key]
+                return None
+            return hit[1]
+
+    def set(self, key: Tuple[Any, ...], value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, folder_id: Optional[str] = None) -> None:
+        """folder_id のエントリと、それを含みうる再帰一覧を破棄する（省略時は全件）。"""
+        with self._lock:
+            if folder_id is None:
+                self._items.clear()
+                return
+            for key in [k for k in self._items if k[0] == folder_id or k[1]]:
+                del self._items[key]
+
+
+_cache: Optional[ListingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_listing_cache() -> ListingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ListingCache(ttl=get_settings().box_list_cache_ttl)
+        return _cache
+
+
+def invalidate_listing(folder_id: Optional[str] = None) -> None:
+    get_listing_cache().invalidate(_normalize_folder_id(folder_id) if folder_id else None)
+
+
+def _fetch_page(
+    folder_id: str, limit: int, marker: Optional[str], fields: Sequence[str]
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """フォルダ直下の1ページのみを取得する（マーカー方式）。"""
+    client = get_box_client()
+    params: Dict[str, Any] = {"limit": limit, "usemarker": "true", "fields": ",".join(fields)}
+    if marker:
+        params["marker"] = marker
+    url = client.folder(folder_id=folder_id).get_url("items")
+    body = client.session.get(url, params=params).json()
+    rows = [{f: entry.get(f) for f in fields} for entry in body.get("entries", [])]
+    return rows, body.get("next_marker") or None
+
+
+def list_items_page(
+    folder_id: str, limit: int, marker: Optional[str] = None, fields: Sequence[str] = ITEM_FIELDS
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """フォルダ直下の1ページ分と次ページのマーカーを返す（キャッシュあり）。"""
+    folder_id = _normalize_folder_id(folder_id)
+    cache = get_listing_cache()
+    key = (folder_id, False, tuple(fields), "page", limit, marker)
+    hit = cache.get(key)
+    if hit is None:
+        hit = _fetch_page(folder_id, limit, marker, fields)
+        cache.set(key, hit)
+    return hit
+
+
+def list_items(folder_id: str, fields: Sequence[str] = ITEM_FIELDS) -> List[Dict[str, Any]]:
+    """フォルダ直下の全アイテム（マーカーで全ページを取得、キャッシュあり）。"""
+    folder_id = _normalize_folder_id(folder_id)
+    cache = get_listing_cache()
+    key = (folder_id, False, tuple(fields))
+    rows = cache.get(key)
+    if rows is None:
+        rows, marker = _fetch_page(folder_id, _PAGE_LIMIT, None, fields)
+        while marker:
+            page, marker = _fetch_page(folder_id, _PAGE_LIMIT, marker, fields)
+            rows.extend(page)
+        cache.set(key, rows)
+    return rows
+
+
+def _is_pdf(row: Dict[str, Any]) -> bool:
+    return row.get("type") == "file" and str(row.get("name", "")).lower().endswith(".pdf")
+
+
+def list_pdfs(folder_id: str, recursive: bool = False) -> List[Dict[str, Any]]:
+    """PDFファイル一覧。
+
+    recursive=True ではフォルダ単位のキャッシュを再利用しながら配下を走査する。
+    """
+    folder_id = _normalize_folder_id(folder_id)
+    if not recursive:
+        return [r for r in list_items(folder_id, PDF_FIELDS) if _is_pdf(r)]
+
+    cache = get_listing_cache()
+    key = (folder_id, True, PDF_FIELDS)
+    rows = cache.get(key)
+    if rows is not None:
+        return rows
+
+    rows = []
+    stack = [folder_id]
+    while stack:
+        fid = stack.pop()
+        for r in list_items(fid, PDF_FIELDS):
+            if r.get("type") == "folder":
+                stack.append(str(r.get("id")))
+            elif _is_pdf(r):
+                rows.append({**r, "folder_id": fid})
+    cache.set(key, rows)
+    return rows
+
+
+__all__ = [
+    "ITEM_FIELDS",
+    "PDF_FIELDS",
+    "ListingCache",
+    "get_listing_cache",
+    "invalidate_listing",
+    "list_items_page",
+    "list_items",
+    "list_pdfs",
+]
@@ -0,0 +1,233 @@
+"""Box への並列アップロード。
+
+- 1つのBoxクライアントを全ワーカーで共有
+- ファイル単位の並列数は BOX_UPLOAD_WORKERS で制限
+- BOX_CHUNKED_UPLOAD_THRESHOLD_MB 以上のファイルは分割アップロード（Upload Session）を使い、
+  パートを並列送信。失敗したパートは再試行し、同一プロセス内で同じファイルを再実行した場合は
+  送信済みパートを飛ばして再開する。
+- 進捗（バイト単位）は呼び出し元スレッドで on_progress に通知する（Streamlit から安全に描画可能）。
+  通常アップロードはマルチパート本文をストリーミング送信し、ソケットへ読み出された量を進捗とする。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .config import get_settings
+
+ProgressCallback = Callable[[int, int], None]
+
+# 再開可能な分割アップロードセッション: (folder_id, name, size, sha1) -> session_id
+_pending_sessions: Dict[Tuple[str, str, int, str], str] = {}
+_pending_lock = threading.Lock()
+
+
+@dataclass
+class UploadResult:
+    name: str
+    size: int
+    file_id: Optional[str] = None
+    chunked: bool = False
+    error: Optional[BaseException] = None
+
+
+class _Progress:
+    """ファイルごとの送信済みバイト数（スレッドセーフ）。"""
+
+    def __init__(self) -> None:
+        self._done: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def set(self, slot: int, value: int) -> None:
+        with self._lock:
+            self._done[slot] = value
+
+    def add(self, slot: int, delta: int) -> None:
+        with self._lock:
+            self._done[slot] = self._done.get(slot, 0) + delta
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self._done.values())
+
+
+class UploadManager:
+    """Boxクライアントを共有し、ファイル/パートを並列にアップロードする。"""
+
+    def __init__(
+        self,
+        client: Any,
+        max_workers: int | None = None,
+        part_workers: int | None = None,
+        chunk_threshold: int | None = None,
+        max_retries: int | None = None,
+    ) -> None:
+        settings = get_settings()
+        self.client = client
+        self.max_workers = max_workers or settings.box_upload_workers
+        self.part_workers = part_workers or settings.box_upload_part_workers
+        self.chunk_threshold = chunk_threshold or settings.box_chunked_upload_threshold
+        self.max_retries = settings.box_upload_retries if max_retries is None else max_retries
+
+    # ---- 公開API ----
+    def upload(
+        self,
+        folder_id: str,
+        files: List[Tuple[str, bytes]],
+        on_progress: ProgressCallback | None = None,
+        poll_interval: float = 0.2,
+    ) -> List[UploadResult]:
+        """files を folder_id に並列アップロードし、入力順の結果を返す。
+
+        on_progress(送信済みバイト, 総バイト) は呼び出し元スレッドから呼ばれる。
+        """
+        total = sum(len(data) for _, data in files)
+        results = [UploadResult(name=name, size=len(data)) for name, data in files]
+        progress = _Progress()
+        with (
+            ThreadPoolExecutor(self.max_workers, thread_name_prefix="box-upload") as pool,
+            ThreadPoolExecutor(self.part_workers, thread_name_prefix="box-part") as parts,
+        ):
+            futures: Dict[Future, int] = {
+                pool.submit(self._upload_one, folder_id, slot, name, data, parts, progress): slot
+                for slot, (name, data) in enumerate(files)
+            }
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(
+                    pending, timeout=poll_interval, return_when=FIRST_COMPLETED
+                )
+                for f in finished:
+                    res = results[futures[f]]
+                    try:
+                        res.file_id, res.chunked = f.result()
+                    except Exception as e:
+                        res.error = e
+                if on_progress:
+                    on_progress(min(progress.total(), total), total)
+        return results
+
+    # ---- 内部処理 ----
+    def _upload_one(
+        self,
+        folder_id: str,
+        slot: int,
+        name: str,
+        data: bytes,
+        parts: ThreadPoolExecutor,
+        progress: _Progress,
+    ) -> Tuple[str, bool]:
+        if len(data) < self.chunk_threshold:
+            # 再試行のたびにエンコーダを作り直すので、本文は先頭から送り直される
+            file_id = self._retry(
+                lambda: self._upload_stream(folder_id, slot, name, data, progress)
+            )
+            progress.set(slot, len(data))
+            return file_id, False
+        folder = self.client.folder(folder_id=folder_id)
+        item = self._upload_chunked(folder_id, folder, slot, name, data, parts, progress)
+        return item.id, True
+
+    def _upload_stream(
+        self, folder_id: str, slot: int, name: str, data: bytes, progress: _Progress
+    ) -> str:
+        """/files/content へ本文をストリーミング送信し、作成されたファイルIDを返す。
+
+        folder.upload_stream() は本文の読み出し量を外から観測できないため、
+        MultipartEncoderMonitor で実際に送信された量を進捗として報告する。
+        """
+        from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+
+        encoder = MultipartEncoder(
+            fields=[
+                ("attributes", json.dumps({"name": name, "parent": {"id": folder_id}})),
+                ("file", ("unused", data)),
+            ]
+        )
+        # 本文にはマルチパートの区切り等が含まれるため、ファイルのバイト数に按分する
+        monitor = MultipartEncoderMonitor(
+            encoder, lambda m: progress.set(slot, len(data) * m.bytes_read // m.len)
+        )
+        session = self.client.session
+        response = session.post(
+            f"{session.api_config.UPLOAD_URL}/files/content",
+            data=monitor,
+            headers={"Content-Type": monitor.content_type},
+            expect_json_response=False,
+        ).json()
+        entry = response["entries"][0] if "entries" in response else response
+        return str(entry["id"])
+
+    def _upload_chunked(
+        self,
+        folder_id: str,
+        folder: Any,
+        slot: int,
+        name: str,
+        data: bytes,
+        parts: ThreadPoolExecutor,
+        progress: _Progress,
+    ) -> Any:
+        size = len(data)
+        sha1 = hashlib.sha1(data)
+        key = (folder_id, name, size, sha1.hexdigest())
+
+        session = None
+        uploaded: Dict[int, Dict[str, Any]] = {}
+        with _pending_lock:
+            session_id = _pending_sessions.get(key)
+        if session_id:
+            # 前回失敗したセッションを再開（期限切れ等で取得できなければ新規作成）
+            try:
+                session = self.client.upload_session(session_id=session_id).get()
+                uploaded = {int(p["offset"]): p for p in session.get_parts()}
+            except Exception:
+                session, uploaded = None, {}
+        if session is None:
+            session = self._retry(
+                lambda: folder.create_upload_session(file_size=size, file_name=name)
+            )
+            with _pending_lock:
+                _pending_sessions[key] = session.id
+        progress.set(slot, sum(int(p.get("size", 0)) for p in uploaded.values()))
+
+        part_size = int(session.part_size)
+        offsets = [o for o in range(0, size, part_size) if o not in uploaded]
+        futures = [
+            parts.submit(self._upload_part, session, data, o, part_size, slot, progress)
+            for o in offsets
+        ]
+        for f in futures:
+            part = f.result()  # 失敗時はセッションを残したまま例外を送出（再実行で再開）
+            uploaded[int(part["offset"])] = part
+
+        ordered = [uploaded[o] for o in sorted(uploaded)]
+        item = self._retry(lambda: session.commit(content_sha1=sha1.digest(), parts=ordered))
+        with _pending_lock:
+            _pending_sessions.pop(key, None)
+        return item
+
+    def _upload_part(
+        self, session: Any, data: bytes, offset: int, part_size: int, slot: int, progress: _Progress
+    ) -> Dict[str, Any]:
+        chunk = data[offset : offset + part_size]
+        part = self._retry(
+            lambda: session.upload_part_bytes(part_bytes=chunk, offset=offset, total_size=len(data))
+        )
+        progress.add(slot, len(chunk))
+        return part
+
+    def _retry(self, fn: Callable[[], Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn()
+            except Exception:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(min(2**attempt, 30))
@@ -0,0 +1,181 @@
+"""墓標（論理削除）の物理削除＝インデックスのコンパクション。
+
+同期での削除/更新はマニフェストに墓標を付けるだけで、検索は墓標付きのベクトルを即時に除外する。
+墓標の割合が VECTOR_COMPACT_RATIO を超えたインデックスは、同期後にバックグラウンドで
+墓標付きのベクトルを1回の ``vs.delete`` でまとめて取り除いて保存し直す。
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from . import metrics
+from .config import get_settings
+from .manifest import Manifest, manifest_path
+from .shards import index_write_lock, read_ntotal, save_index
+
+logger = logging.getLogger(__name__)
+
+_INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+@dataclass
+class CompactionResult:
+    index_dir: str
+    vectors_before: int
+    vectors_after: int
+    purged: int
+    bytes_before: int
+    bytes_after: int
+    elapsed_sec: float
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return max(0, self.bytes_before - self.bytes_after)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "reclaimed_bytes": self.reclaimed_bytes}
+
+
+def _index_bytes(index_dir: str) -> int:
+    """インデックスの保存サイズ（FAISS 本体 + docstore）。ロード時のメモリ使用量の目安。"""
+    total = 0
+    for name in _INDEX_FILES:
+        with contextlib.suppress(FileNotFoundError):
+            total += (Path(index_dir) / name).stat().st_size
+    return total
+
+
+def tombstone_stats(index_dir: str) -> Dict[str, Any]:
+    """墓標数・ベクトル数・墓標の割合（インデックス本体はロードしない）。"""
+    vectors = read_ntotal(index_dir) or 0
+    dead = 0
+    if manifest_path(index_dir).exists():
+        with Manifest(index_dir) as manifest:
+            dead = manifest.tombstone_count()
+    return {
+        "index_dir": index_dir,
+        "vectors": vectors,
+        "tombstones": dead,
+        "ratio": dead / vectors if vectors else 0.0,
+        "bytes": _index_bytes(index_dir),
+    }
+
+
+def needs_compaction(index_dir: str, threshold: Optional[float] = None) -> bool:
+    threshold = get_settings().vector_compact_ratio if threshold is None else threshold
+    if threshold <= 0:
+        return False
+    stats = tombstone_stats(index_dir)
+    return stats["tombstones"] > 0 and stats["ratio"] >= threshold
+
+
+def compact_index(index_dir: str) -> Optional[CompactionResult]:
+    """墓標付きのベクトルを物理削除して保存し直す（インデックス未作成なら None）。"""
+    from .ingest import _load_index_if_exists
+
+    started = time.perf_counter()
+    with index_write_lock(index_dir):
+        vs = _load_index_if_exists(index_dir)
+        if vs is None:
+            return None
+        bytes_before = _index_bytes(index_dir)
+        vectors_before = int(vs.index.ntotal)
+        with Manifest(index_dir) as manifest:
+            dead = manifest.tombstones()
+            dead_set = set(dead)
+            purge = [i for i in vs.index_to_docstore_id.values() if i in dead_set]
+            if purge:
+                vs.delete(purge)  # remove_ids と ID 対応表の再構築を1回で済ませる
+                save_index(vs, index_dir)
+            manifest.mark_purged(dead)
+        result = CompactionResult(
+            index_dir=index_dir,
+            vectors_before=vectors_before,
+            vectors_after=int(vs.index.ntotal),
+            purged=len(purge),
+            bytes_before=bytes_before,
+            bytes_after=_index_bytes(index_dir),
+            elapsed_sec=round(time.perf_counter() - started, 3),
+        )
+    metrics.incr("compaction.runs")
+    metrics.observe("compaction.reclaimed_bytes", result.reclaimed_bytes)
+    _results.append(result)
+    logger.info(
+        "コンパクション完了: %s（%d → %d ベクトル、%d 件削除、%.1f MB 解放）",
+        index_dir,
+        result.vectors_before,
+        result.vectors_after,
+        result.purged,
+        result.reclaimed_bytes / 1024 / 1024,
+    )
+    return result
+
+
+_results: Deque[CompactionResult] = deque(maxlen=50)
+_threads: Dict[str, threading.Thread] = {}
+_threads_lock = threading.Lock()
+
+
+def _run_in_background(index_dir: str) -> None:
+    try:
+        compact_index(index_dir)
+    except Exception:
+        logger.exception("コンパクションに失敗しました: %s", index_dir)
+
+
+def schedule_compaction(index_dirs: Iterable[str], threshold: Optional[float] = None) -> List[str]:
+    """墓標の割合がしきい値を超えたインデックスをバックグラウンドで圧縮する。開始したディレクトリを返す。"""
+    started: List[str] = []
+    for index_dir in index_dirs:
+        try:
+            if not needs_compaction(index_dir, threshold):
+                continue
+        except Exception:
+            logger.exception("墓標の集計に失敗しました: %s", index_dir)
+            continue
+        with _threads_lock:
+            running = _threads.get(index_dir)
+            if running is not None and running.is_alive():
+                continue
+            t = threading.Thread(
+                target=_run_in_background,
+                args=(index_dir,),
+                name=f"compact:{Path(index_dir).name}",
+                daemon=True,
+            )
+            _threads[index_dir] = t
+            t.start()
+        started.append(index_dir)
+    return started
+
+
+def wait_for_compaction(timeout: Optional[float] = None) -> None:
+    """実行中のバックグラウンド・コンパクションの終了を待つ（CLI の終了前など）。"""
+    with _threads_lock:
+        threads = list(_threads.values())
+    for t in threads:
+        t.join(timeout)
+
+
+def recent_results() -> List[CompactionResult]:
+    """このプロセスで実行したコンパクションの結果（新しい順）。"""
+    return list(reversed(_results))
+
+
+__all__ = [
+    "CompactionResult",
+    "compact_index",
+    "needs_compaction",
+    "recent_results",
+    "schedule_compaction",
+    "tombstone_stats",
+    "wait_for_compaction",
+]
@@ -17,6 +17,14 @@ class Settings:
     box_client_secret: str | None
     box_subject_type: str | None
     box_subject_id: str | None
+    box_upload_workers: int
+    box_upload_part_workers: int
+    box_chunked_upload_threshold: int
+    box_upload_retries: int
+    box_max_retries: int
+    box_http_pool_size: int
+    box_token_refresh_margin: int
+    box_list_cache_ttl: int
 
     embeddings_provider: str
     embeddings_model: str
@@ -25,6 +33,16 @@ class Settings:
     # Vector Store / Retrieval
     vector_dir: str
     top_k: int
+    vector_sharding: str
+    vector_shard_buckets: int
+    vector_shard_cache: int
+    retrieval_workers: int
+    vector_compact_ratio: float
+    context_token_budget: int
+    context_expand_neighbors: bool
+    retrieval_server_url: str | None
+    retrieval_batch_window_ms: int
+    retrieval_batch_max: int
 
     # LangSmith
     langsmith_tracing: str | None
@@ -33,10 +51,15 @@ class Settings:
 
     # App
     log_level: str
+    warmup: bool
+    profiling: bool
+    profiles_dir: str
+    profiles_keep: int
 
     # LLM
     llm_provider: str
     llm_model: str
+    llm_max_concurrency: int
 
 
 def _to_int(value: str | None, default: int) -> int:
@@ -46,6 +69,19 @@ def _to_int(value: str | None, default: int) -> int:
         return default
 
 
+def _to_float(value: str | None, default: float) -> float:
+    try:
+        return float(value) if value is not None else default
+    except ValueError:
+        return default
+
+
+def _to_bool(value: str | None, default: bool) -> bool:
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 @lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Load settings from environment (.env supported).
@@ -53,6 +89,34 @@ def get_settings() -> Settings:
     Notes
     - TOP_K: 取得する関連チャンク数（既定: 5）。値が不正な場合は5にフォールバック。
     - VECTOR_DIR: ベクタインデックス保存先（既定: ./app/stores/box_index_v1）。
+    - VECTOR_SHARDING: none（単一インデックス）/ folder（トップレベルフォルダ単位）/
+      hash（ファイルIDのハッシュ単位）。
+    - VECTOR_SHARD_BUCKETS: hash 分割時のバケット数（既定: 8）。
+    - VECTOR_SHARD_CACHE: メモリに保持するシャード数の上限（0 は無制限）。
+    - RETRIEVAL_WORKERS: シャード横断検索の並列数（既定: 4）。
+    - VECTOR_COMPACT_RATIO: 墓標（論理削除）の割合がこれを超えたら同期後にバックグラウンドで
+      物理削除する（既定: 0.2、0 で無効）。
+    - CONTEXT_TOKEN_BUDGET: プロンプトに詰めるコンテキストの概算トークン上限
+      （既定: 0 = 無制限で結合・重複除去のみ。日本語は概ね1文字1トークンで数えるため、
+      制限する場合は TOP_K × チャンク文字数より大きくする）。
+    - CONTEXT_EXPAND_NEIGHBORS: 予算が残れば検索ヒットの前後チャンクも含める（既定: false）。
+    - RETRIEVAL_SERVER_URL: 検索サーバの接続先（http://127.0.0.1:8765 または
+      unix:///path/to.sock、未設定ならプロセス内検索）。
+    - RETRIEVAL_BATCH_WINDOW_MS / RETRIEVAL_BATCH_MAX: 検索サーバが同時のクエリをまとめる
+      待ち時間（既定: 5ms）と最大件数（既定: 32）。
+    - LLM_MAX_CONCURRENCY: CLI の一括質問で同時に実行する LLM 呼び出し数（既定: 4）。
+    - BOX_UPLOAD_WORKERS / BOX_UPLOAD_PART_WORKERS: ファイル単位/パート単位のアップロード並列数
+      （既定: 4）。
+    - BOX_CHUNKED_UPLOAD_THRESHOLD_MB: 分割アップロードに切り替えるサイズ（既定・最小: 20MB）。
+    - BOX_MAX_RETRIES: 429/5xx 時の再試行回数（既定: 5、Retry-After を優先）。
+    - BOX_HTTP_POOL_SIZE: Box API への keep-alive 接続プールの大きさ（既定: 16）。
+    - BOX_TOKEN_REFRESH_MARGIN: CCGトークンを期限の何秒前に更新するか（既定: 300）。
+    - BOX_LIST_CACHE_TTL: Box管理画面のフォルダ一覧キャッシュの有効秒数（既定: 120）。
+    - WARMUP: 起動時にバックグラウンドでインデックス/クライアントを事前ロードする（既定: true）。
+    - PROFILING: 質問/同期ごとにプロファイルを記録する（既定: false、要 pyinstrument）。
+      画面のトグルでも切り替え可。
+    - PROFILES_DIR / PROFILES_KEEP: プロファイルの保存先（既定: ./app/stores/profiles）と
+      保持する実行数（既定: 20）。
     """
     load_dotenv(override=False)
 
@@ -65,21 +129,49 @@ def get_settings() -> Settings:
         box_client_secret=os.getenv("BOX_CLIENT_SECRET"),
         box_subject_type=os.getenv("BOX_SUBJECT_TYPE"),
         box_subject_id=os.getenv("BOX_SUBJECT_ID"),
+        box_upload_workers=max(1, _to_int(os.getenv("BOX_UPLOAD_WORKERS"), 4)),
+        box_upload_part_workers=max(1, _to_int(os.getenv("BOX_UPLOAD_PART_WORKERS"), 4)),
+        # Box の分割アップロードは 20MB 以上のファイルのみ利用可能
+        box_chunked_upload_threshold=max(
+            20, _to_int(os.getenv("BOX_CHUNKED_UPLOAD_THRESHOLD_MB"), 20)
+        )
+        * 1024
+        * 1024,
+        box_upload_retries=max(0, _to_int(os.getenv("BOX_UPLOAD_RETRIES"), 3)),
+        box_max_retries=max(0, _to_int(os.getenv("BOX_MAX_RETRIES"), 5)),
+        box_http_pool_size=max(1, _to_int(os.getenv("BOX_HTTP_POOL_SIZE"), 16)),
+        box_token_refresh_margin=max(0, _to_int(os.getenv("BOX_TOKEN_REFRESH_MARGIN"), 300)),
+        box_list_cache_ttl=max(0, _to_int(os.getenv("BOX_LIST_CACHE_TTL"), 120)),
         embeddings_provider=os.getenv("EMBEDDINGS_PROVIDER", "bedrock"),
         embeddings_model=os.getenv("EMBEDDINGS_MODEL", "amazon.titan-embed-text-v2:0"),
         aws_region=os.getenv("AWS_REGION"),
         # Vector / Retrieval
         vector_dir=os.getenv("VECTOR_DIR", "./app/stores/box_index_v1"),
         top_k=_to_int(os.getenv("TOP_K"), 5),
+        vector_sharding=os.getenv("VECTOR_SHARDING", "none").lower(),
+        vector_shard_buckets=max(1, _to_int(os.getenv("VECTOR_SHARD_BUCKETS"), 8)),
+        vector_shard_cache=max(0, _to_int(os.getenv("VECTOR_SHARD_CACHE"), 0)),
+        retrieval_workers=max(1, _to_int(os.getenv("RETRIEVAL_WORKERS"), 4)),
+        vector_compact_ratio=max(0.0, _to_float(os.getenv("VECTOR_COMPACT_RATIO"), 0.2)),
+        context_token_budget=max(0, _to_int(os.getenv("CONTEXT_TOKEN_BUDGET"), 0)),
+        context_expand_neighbors=_to_bool(os.getenv("CONTEXT_EXPAND_NEIGHBORS"), False),
+        retrieval_server_url=os.getenv("RETRIEVAL_SERVER_URL") or None,
+        retrieval_batch_window_ms=max(0, _to_int(os.getenv("RETRIEVAL_BATCH_WINDOW_MS"), 5)),
+        retrieval_batch_max=max(1, _to_int(os.getenv("RETRIEVAL_BATCH_MAX"), 32)),
         # LangSmith
         langsmith_tracing=os.getenv("LANGSMITH_TRACING"),
         langsmith_api_key=os.getenv("LANGSMITH_API_KEY"),
         langsmith_project=os.getenv("LANGSMITH_PROJECT"),
         # App
         log_level=os.getenv("LOG_LEVEL", "INFO"),
+        warmup=_to_bool(os.getenv("WARMUP"), True),
+        profiling=_to_bool(os.getenv("PROFILING"), False),
+        profiles_dir=os.getenv("PROFILES_DIR", "./app/stores/profiles"),
+        profiles_keep=max(1, _to_int(os.getenv("PROFILES_KEEP"), 20)),
         # LLM
         llm_provider=os.getenv("LLM_PROVIDER", "bedrock"),
         llm_model=os.getenv("LLM_MODEL", "anthropic.claude-3-haiku-20240307-v1:0"),
+        llm_max_concurrency=max(1, _to_int(os.getenv("LLM_MAX_CONCURRENCY"), 4)),
     )
 
 
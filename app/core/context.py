@@ -0,0 +1,207 @@
+"""検索結果からプロンプト用コンテキストを組み立てる（重複除去・結合・トークン予算内への詰め込み）。
+
+分割時の chunk_overlap により、同じファイル/ページの隣接チャンクは本文が重複する。
+同じファイルの同一ページのチャンクは重なり部分を1回だけ残して結合し、関連度順に予算内へ詰める。
+ファイルはベクトルIDの接頭辞（``box:<file_id>@<generation>``）で識別し、同名の別ファイルは結合しない。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import metrics
+
+if TYPE_CHECKING:  # pragma: no cover
+    from langchain_core.documents import Document
+
+DocumentLookup = Callable[[str], Optional["Document"]]
+
+_MIN_OVERLAP = 20  # これより短い一致は偶然とみなして結合しない
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCII は約4文字/トークン、日本語などは約1文字/トークン）。"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def merge_overlapping(a: str, b: str, min_overlap: int = _MIN_OVERLAP) -> Optional[str]:
+    """a の末尾と b の先頭が重なっていれば結合した文字列を返す（包含関係も考慮）。"""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    for k in range(min(len(a), len(b)), min_overlap - 1, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return None
+
+
+def _parse_vector_id(doc: Document) -> Optional[Tuple[str, int]]:
+    """``box:<file_id>[@<generation>]:<chunk_index>`` 形式のIDを (接頭辞, チャンク番号) にする。"""
+    doc_id = getattr(doc, "id", None)
+    if not doc_id or not str(doc_id).startswith("box:"):
+        return None
+    prefix, _, idx = str(doc_id).rpartition(":")
+    try:
+        return prefix, int(idx)
+    except ValueError:
+        return None
+
+
+def _render(source: object, page: object, text: str) -> str:
+    return f"[source:{source} page:{page}]\n{text}"
+
+
+@dataclass
+class _Span:
+    source: object
+    page: object
+    text: str
+    rank: int
+    first: int  # 先頭チャンク番号
+    last: int  # 末尾チャンク番号
+    id_prefix: Optional[str] = None
+    tokens: int = field(init=False, default=0)
+
+    def render(self) -> str:
+        return _render(self.source, self.page, self.text)
+
+
+def _chunk_index(doc: Document, default: int) -> int:
+    try:
+        return int(doc.metadata.get("chunk_index", default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _group_key(doc: Document) -> Tuple[object, ...]:
+    """結合してよいチャンクの組。Box 由来はファイルID（と世代）、それ以外はファイル名で区別する。"""
+    parsed = _parse_vector_id(doc)
+    if parsed is not None:
+        return ("id", parsed[0], doc.metadata.get("page"))
+    return ("source", doc.metadata.get("source"), doc.metadata.get("page"))
+
+
+def _build_spans(docs: Sequence[Document]) -> List[_Span]:
+    groups: Dict[Tuple[object, ...], List[Tuple[int, int, Document]]] = {}
+    for rank, d in enumerate(docs):
+        groups.setdefault(_group_key(d), []).append((_chunk_index(d, rank), rank, d))
+
+    spans: List[_Span] = []
+    for hits in groups.values():
+        hits.sort(key=lambda h: h[0])
+        current: Optional[_Span] = None
+        for idx, rank, d in hits:
+            parsed = _parse_vector_id(d)
+            source, page = d.metadata.get("source"), d.metadata.get("page")
+            if current is not None:
+                merged = merge_overlapping(current.text, d.page_content)
+                if merged is None and idx == current.last + 1:
+                    merged = current.text + "\n" + d.page_content
+                if merged is not None:
+                    current.text = merged
+                    current.rank = min(current.rank, rank)
+                    current.last = max(current.last, idx)
+                    continue
+                spans.append(current)
+            prefix = parsed[0] if parsed else None
+            current = _Span(source, page, d.page_content, rank, idx, idx, prefix)
+        if current is not None:
+            spans.append(current)
+    for s in spans:
+        s.tokens = estimate_tokens(s.render())
+    spans.sort(key=lambda s: s.rank)
+    return spans
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def _expand(span: _Span, lookup: DocumentLookup, remaining: int) -> int:
+    """予算が残る限り前後の隣接チャンクを取り込む。増えたトークン数を返す。"""
+    used = 0
+    for step in (-1, 1):
+        if span.id_prefix is None:
+            break
+        idx = span.first - 1 if step < 0 else span.last + 1
+        if idx < 0:
+            continue
+        neighbor = lookup(f"{span.id_prefix}:{idx}")
+        if neighbor is None or (neighbor.metadata.get("source"), neighbor.metadata.get("page")) != (
+            span.source,
+            span.page,
+        ):
+            continue
+        if step < 0:
+            text = merge_overlapping(neighbor.page_content, span.text) or (
+                neighbor.page_content + "\n" + span.text
+            )
+        else:
+            text = merge_overlapping(span.text, neighbor.page_content) or (
+                span.text + "\n" + neighbor.page_content
+            )
+        tokens = estimate_tokens(_render(span.source, span.page, text))
+        if tokens - span.tokens > remaining - used:
+            continue
+        used += tokens - span.tokens
+        span.text, span.tokens = text, tokens
+        if step < 0:
+            span.first = idx
+        else:
+            span.last = idx
+    return used
+
+
+def pack_context(
+    docs: Sequence[Document],
+    budget: int,
+    expand_neighbors: bool = False,
+    lookup: Optional[DocumentLookup] = None,
+) -> str:
+    """検索結果を結合・重複除去し、関連度順に budget（概算トークン、0 は無制限）内へ詰める。
+
+    expand_neighbors=True かつ lookup が与えられた場合、予算が残れば隣接チャンクで文脈を補う。
+    詰め込み前後のトークン数は metrics（prompt.context_tokens_raw / _packed）に記録する。
+    """
+    raw_tokens = sum(
+        estimate_tokens(_render(d.metadata.get("source"), d.metadata.get("page"), d.page_content))
+        for d in docs
+    )
+    spans = _build_spans(docs)
+
+    packed: List[_Span] = []
+    used = 0
+    for s in spans:
+        if budget and used + s.tokens > budget:
+            if packed:
+                continue  # 大きすぎる断片は飛ばし、後続の小さい断片を試す
+            header_tokens = estimate_tokens(_render(s.source, s.page, ""))
+            s.text = _truncate_to_tokens(s.text, max(0, budget - header_tokens))
+            s.tokens = estimate_tokens(s.render())
+        packed.append(s)
+        used += s.tokens
+
+    if expand_neighbors and lookup is not None:
+        for s in packed:
+            remaining = budget - used if budget else 1 << 30
+            if remaining <= 0:
+                break
+            used += _expand(s, lookup, remaining)
+
+    context = "\n\n".join(s.render() for s in packed)
+    metrics.observe("prompt.context_tokens_raw", raw_tokens)
+    metrics.observe("prompt.context_tokens_packed", estimate_tokens(context))
+    return context
+
+
+__all__ = ["estimate_tokens", "merge_overlapping", "pack_context"]
@@ -1,24 +1,35 @@
 from __future__ import annotations
 
-from typing import Iterable, List, Tuple, Dict, Any
-import io
-import json
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Iterable, List, Tuple, Dict, Any
 from pathlib import Path
 import re
+import shutil
 
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-
+from .box_client import get_box_client
+from .box_upload import UploadManager
 from .config import get_settings
+from .manifest import Manifest, vector_id
+from .shards import (
+    LOCAL_SHARD,
+    evict_shard,
+    index_write_lock,
+    list_shards,
+    shard_dir,
+    shard_key_for_file,
+    sharding_enabled,
+    sharding_mode,
+    save_index,
+    stored_vector_count,
+)
 from .utils import ensure_dir, pdf_bytes_to_documents
 
-try:
-    from boxsdk import Client, OAuth2
-    from boxsdk.auth.ccg_auth import CCGAuth
-except Exception:  # pragma: no cover - optional import until Box接続時に使用
-    Client = None  # type: ignore
-    OAuth2 = None  # type: ignore
-    CCGAuth = None  # type: ignore
+if TYPE_CHECKING:  # pragma: no cover
+    from boxsdk import Client
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+SyncProgressCallback = Callable[[int, int, str], None]
 
 
 def build_embeddings():
@@ -39,69 +50,73 @@ def build_embeddings():
     )
 
 
-def load_or_create_index(docs: List[Document] | None = None) -> FAISS:
-    settings = get_settings()
-    ensure_dir(settings.vector_dir)
-    try:
-        vs = FAISS.load_local(settings.vector_dir, build_embeddings(), allow_dangerous_deserialization=True)
-        if docs:
-            vs.add_documents(docs)
-            vs.save_local(settings.vector_dir)
-        return vs
-    except Exception:
-        # 新規作成
-        if not docs:
-            raise ValueError(
-                "インデックスが未作成で、追加するドキュメントが空です。画像のみのPDFや空文書ではテキスト抽出できない場合があります。"
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """プロセス共有の Embeddings クライアント（Bedrock クライアント生成を毎回行わない）。"""
+    return build_embeddings()
+
+
+def load_or_create_index(
+    docs: List[Document] | None = None, vector_dir: str | None = None
+) -> FAISS:
+    from langchain_community.vectorstores import FAISS
+
+    vector_dir = vector_dir or get_settings().vector_dir
+    ensure_dir(vector_dir)
+    # 同期・コンパクションと同じロックでロード〜保存を直列化する（更新の取りこぼし防止）
+    with index_write_lock(vector_dir):
+        try:
+            vs = FAISS.load_local(
+                vector_dir, get_embeddings(), allow_dangerous_deserialization=True
             )
-        vs = FAISS.from_documents(docs, build_embeddings())
-        vs.save_local(settings.vector_dir)
-        return vs
+            if docs:
+                vs.add_documents(docs)
+                save_index(vs, vector_dir)
+            return vs
+        except Exception:
+            # 新規作成
+            if not docs:
+                raise ValueError(
+                    "インデックスが未作成で、追加するドキュメントが空です。"
+                    "画像のみのPDFや空文書ではテキスト抽出できない場合があります。"
+                )
+            vs = FAISS.from_documents(docs, get_embeddings())
+            save_index(vs, vector_dir)
+            return vs
 
 
-def upsert_documents(docs: List[Document]) -> Tuple[int, int]:
+def upsert_documents(docs: List[Document], shard: str | None = None) -> Tuple[int, int]:
     """ドキュメントをベクタストアに追加/更新し保存。
 
+    シャード構成時は shard（省略時はローカル追加用シャード）に格納する。
+
     Returns: (追加件数, 総件数)
     """
-    vs = load_or_create_index(docs)
-    total = vs.index.ntotal
-    return len(docs), total
+    if not sharding_enabled():
+        vs = load_or_create_index(docs)
+        return len(docs), vs.index.ntotal
+    load_or_create_index(docs, shard_dir(shard or LOCAL_SHARD))
+    return len(docs), stored_vector_count() or 0
 
 
 # =============================
 # Box 同期（追加/更新/削除）
 # =============================
-def _manifest_path() -> Path:
-    settings = get_settings()
-    return Path(settings.vector_dir) / "box_manifest.json"
-
-
-def _load_manifest() -> Dict[str, Any]:
-    p = _manifest_path()
-    if not p.exists():
-        return {}
-    try:
-        return json.loads(p.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-
-
-def _save_manifest(data: Dict[str, Any]) -> None:
-    p = _manifest_path()
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-
-
-def _list_box_pdfs_recursive(client: "Client", folder_id: str) -> List[Dict[str, Any]]:
+def _list_box_pdfs_recursive(
+    client: "Client", folder_id: str, folders: Dict[str, str | None] | None = None
+) -> List[Dict[str, Any]]:
     """フォルダ配下を再帰的に走査しPDFファイルを列挙する。
 
-    Returns: [{id,name,sha1,etag,modified_at,size}]
+    folders を渡すと、走査したフォルダの folder_id -> 親フォルダID を記録する。
+
+    Returns: [{id,name,sha1,etag,modified_at,size,folder_id}]
     """
     result: List[Dict[str, Any]] = []
 
-    def _walk(fid: str) -> None:
+    def _walk(fid: str, parent: str | None = None) -> None:
         fid = _normalize_folder_id(fid)
+        if folders is not None:
+            folders[fid] = parent
         items = client.folder(folder_id=fid).get_items(
             limit=1000,
             fields=["id", "type", "name", "sha1", "etag", "modified_at", "size"],
@@ -109,7 +124,7 @@ def _list_box_pdfs_recursive(client: "Client", folder_id: str) -> List[Dict[str,
         for it in items:
             itype = getattr(it, "type", "")
             if itype == "folder":
-                _walk(it.id)
+                _walk(it.id, fid)
             elif itype == "file" and str(it.name).lower().endswith(".pdf"):
                 result.append(
                     {
@@ -119,6 +134,7 @@ def _list_box_pdfs_recursive(client: "Client", folder_id: str) -> List[Dict[str,
                         "etag": getattr(it, "etag", None),
                         "modified_at": getattr(it, "modified_at", None),
                         "size": getattr(it, "size", None),
+                        "folder_id": fid,
                     }
                 )
 
@@ -135,118 +151,179 @@ def _fingerprint(meta: Dict[str, Any]) -> str:
     return meta.get("id", "unknown")
 
 
-def _delete_ids_from_faiss(ids: List[str]) -> None:
-    settings = get_settings()
-    vs = FAISS.load_local(settings.vector_dir, build_embeddings(), allow_dangerous_deserialization=True)
-    if ids:
-        try:
-            vs.delete(ids)
-            vs.save_local(settings.vector_dir)
-        except Exception:
-            # ベストエフォート削除
-            pass
+def _load_index_if_exists(vector_dir: str) -> FAISS | None:
+    from langchain_community.vectorstores import FAISS
 
+    if not (Path(vector_dir) / "index.faiss").exists():
+        return None
+    return FAISS.load_local(vector_dir, get_embeddings(), allow_dangerous_deserialization=True)
 
-def sync_box_folders(folder_ids: str) -> Tuple[int, int, int, int]:
-    """Boxの指定フォルダ（再帰）をFAISSに同期する。
 
-    Returns: (added, updated, deleted, total_vectors)
-    """
-    client = _get_box_client()
-    settings = get_settings()
-    manifest = _load_manifest()
+def _sync_index(
+    client: "Client",
+    vector_dir: str,
+    current: Dict[str, Dict[str, Any]],
+    folders: Dict[str, str | None] | None = None,
+    on_progress: SyncProgressCallback | None = None,
+) -> Tuple[int, int, int]:
+    """1つのインデックスを current に同期する。
 
-    # 現状ファイル一覧
-    current: Dict[str, Dict[str, Any]] = {}
-    for fid in [f.strip() for f in folder_ids.split(",") if f.strip()]:
-        for meta in _list_box_pdfs_recursive(client, fid):
-            current[meta["id"]] = meta
+    対象は単一構成ではVECTOR_DIR、シャード構成では各シャード。
+
+    マニフェストはファイル単位でトランザクション更新するため、途中で失敗しても完了分は保持される。
+    削除/更新前のベクトルは墓標を付けるだけで検索から即時に除外し、物理削除はコンパクションで行う。
+    on_progress(処理済み件数, 変更ファイル数, メッセージ) はファイル1件ごとに呼ばれる。
+
+    Returns: (added, updated, deleted)
+    """
+    from langchain_community.vectorstores import FAISS
 
-    # 追加/更新/削除の判定
     added = 0
     updated = 0
     deleted = 0
 
-    to_delete_ids: List[str] = []
-
-    # 削除(現行にないファイル)
-    for file_id, prev in list(manifest.items()):
-        if file_id not in current:
-            ids = prev.get("vector_ids", [])
-            to_delete_ids.extend(ids)
-            manifest.pop(file_id, None)
-            deleted += 1
-
-    if to_delete_ids:
-        _delete_ids_from_faiss(to_delete_ids)
-
-    # 追加/更新
-    vs = load_or_create_index([])
-    for file_id, meta in current.items():
-        fp = _fingerprint(meta)
-        prev = manifest.get(file_id)
-        if prev and prev.get("fingerprint") == fp:
-            continue  # 変更なし
-
-        # 変更あり → 既存削除（あれば）→ 再取り込み
-        if prev and prev.get("vector_ids"):
-            try:
-                vs.delete(prev["vector_ids"])  # 既存を削除
-            except Exception:
-                pass
-
-        # ダウンロードして分割
-        data = client.file(file_id=file_id).content()
-        docs = pdf_bytes_to_documents(meta["name"], data)
-
-        # 安定IDを生成: box:<file_id>:<index>
-        ids = [f"box:{file_id}:{d.metadata.get('chunk_index', i)}" for i, d in enumerate(docs)]
-        vs.add_documents(docs, ids=ids)
-        vs.save_local(settings.vector_dir)
-
-        manifest[file_id] = {"fingerprint": fp, "name": meta["name"], "vector_ids": ids}
-        if prev:
-            updated += 1
-        else:
-            added += 1
-
-    _save_manifest(manifest)
-
-    total_vectors = vs.index.ntotal
-    return added, updated, deleted, total_vectors
+    with index_write_lock(vector_dir), Manifest(vector_dir) as manifest:
+        known = manifest.fingerprints()
+        removed = [file_id for file_id in known if file_id not in current]
+        changed = [
+            (file_id, meta)
+            for file_id, meta in current.items()
+            if known.get(file_id) != _fingerprint(meta)
+        ]
+        generation = manifest.bump_generation() if (removed or changed) else manifest.generation()
+
+        # 削除(現行にないファイル): 墓標を付ける
+        for file_id in removed:
+            manifest.delete_file(file_id, generation)
+        deleted = len(removed)
+
+        # 追加/更新（変更なしは除外）。変更がなければインデックスはロードしない
+        vs = _load_index_if_exists(vector_dir) if changed else None
+        for done, (file_id, meta) in enumerate(changed, start=1):
+            fp = _fingerprint(meta)
+            prev_fp = known.get(file_id)
+
+            # ダウンロードして分割
+            data = client.file(file_id=file_id).content()
+            docs = pdf_bytes_to_documents(meta["name"], data)
+
+            # 世代付きの安定ID: box:<file_id>@<generation>:<index>（旧版のベクトルと共存できる）
+            ids = [
+                vector_id(file_id, generation, d.metadata.get("chunk_index", i))
+                for i, d in enumerate(docs)
+            ]
+
+            if docs:
+                # 保存後・マニフェスト反映前に中断しても検索に出ないよう、反映待ちの墓標を先に付ける
+                manifest.add_tombstones(ids, generation)
+                if vs is None:
+                    ensure_dir(vector_dir)
+                    vs = FAISS.from_documents(docs, get_embeddings(), ids=ids)
+                else:
+                    vs.add_documents(docs, ids=ids)
+                save_index(vs, vector_dir)
+
+            # 旧版のIDに墓標を付け、今回のIDの墓標を外す（1トランザクション）
+            manifest.upsert_file(file_id, meta.get("folder_id"), meta["name"], fp, ids, generation)
+            if prev_fp is not None:
+                updated += 1
+            else:
+                added += 1
+            if on_progress:
+                action = "更新" if prev_fp is not None else "追加"
+                on_progress(done, len(changed), f"{action} {meta['name']}")
+
+        if folders:
+            synced = {m.get("folder_id") for m in current.values()}
+            manifest.mark_folders_synced({fid: p for fid, p in folders.items() if fid in synced})
+
+    return added, updated, deleted
+
+
+def sync_box_folders(
+    folder_ids: str,
+    shards: Iterable[str] | None = None,
+    on_progress: SyncProgressCallback | None = None,
+) -> Tuple[int, int, int, int]:
+    """Boxの指定フォルダ（再帰）をFAISSに同期する。
 
+    シャード構成時は変更のあったシャードのみを書き換える。
+    shards を指定すると対象シャードに限定する。
+    on_progress(処理済み件数, 変更ファイル数, メッセージ) で進捗を受け取れる
+    （インデックス単位で計数）。
 
-def _get_box_client() -> "Client":
+    Returns: (added, updated, deleted, total_vectors)
+    """
+    client = get_box_client()
     settings = get_settings()
-    if Client is None or CCGAuth is None:
-        raise RuntimeError("boxsdk が見つかりません。requirements.txt を確認してください。")
-    method = (settings.box_auth_method or "").lower()
-    if method == "devtoken":
-        if OAuth2 is None:
-            raise RuntimeError("boxsdk が見つかりません。requirements.txt を確認してください。")
-        if not settings.box_developer_token:
-            raise RuntimeError("BOX_DEVELOPER_TOKEN を設定してください（開発トークン）。")
-        # Developer Token は短命・更新不可。テスト用途のみ。
-        oauth = OAuth2(client_id=settings.box_client_id, client_secret=settings.box_client_secret, access_token=settings.box_developer_token)
-        return Client(oauth)
-    elif method == "oauth":  # CCG（Server-side OAuth）
-        if settings.box_subject_type == "user" and settings.box_subject_id:
-            auth = CCGAuth(
-                client_id=settings.box_client_id,
-                client_secret=settings.box_client_secret,
-                user=settings.box_subject_id,
-            )
-        elif settings.box_subject_type == "enterprise" and settings.box_subject_id:
-            auth = CCGAuth(
-                client_id=settings.box_client_id,
-                client_secret=settings.box_client_secret,
-                enterprise_id=settings.box_subject_id,
-            )
-        else:
-            raise RuntimeError("BOX_SUBJECT_TYPE と BOX_SUBJECT_ID を設定してください（user か enterprise）。")
-        return Client(auth)
+    mode = sharding_mode()
+    only = set(shards) if shards is not None else None
+    top_ids = [_normalize_folder_id(f.strip()) for f in folder_ids.split(",") if f.strip()]
+    if mode == "folder" and only is not None:
+        top_ids = [fid for fid in top_ids if shard_key_for_file(fid, "") in only]
+
+    # 現状ファイル一覧（インデックスディレクトリ単位）
+    groups: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    if mode == "none":
+        groups[settings.vector_dir] = {}
+    elif mode == "folder":
+        for fid in top_ids:
+            groups.setdefault(shard_dir(shard_key_for_file(fid, "")), {})
+        # BOX_FOLDER_IDS から外れたフォルダのシャードも対象にして、中身の削除を反映する
+        for key in list_shards():
+            if key.startswith("f"):
+                groups.setdefault(shard_dir(key), {})
     else:
-        raise RuntimeError("BOX_AUTH_METHOD は 'oauth'（CCG）または 'devtoken' をサポートしています。設定を確認してください。")
+        # 既存バケットも対象にして、空になったバケットの削除を反映する
+        for key in list_shards():
+            if key != LOCAL_SHARD:
+                groups.setdefault(shard_dir(key), {})
+    folders: Dict[str, str | None] = {}
+    for fid in top_ids:
+        for meta in _list_box_pdfs_recursive(client, fid, folders):
+            if mode == "none":
+                groups[settings.vector_dir][meta["id"]] = meta
+                continue
+            key = shard_key_for_file(fid, meta["id"])
+            if only is None or key in only:
+                groups.setdefault(shard_dir(key), {})[meta["id"]] = meta
+    if only is not None:
+        groups = {d: cur for d, cur in groups.items() if Path(d).name in only}
+
+    added = updated = deleted = 0
+    for vector_dir, current in groups.items():
+        progress = None
+        if on_progress is not None:
+            label = Path(vector_dir).name if mode != "none" else ""
+
+            def progress(done: int, total: int, message: str, _label: str = label) -> None:
+                on_progress(done, total, f"{_label}: {message}" if _label else message)
+
+        a, u, d = _sync_index(client, vector_dir, current, folders, progress)
+        added += a
+        updated += u
+        deleted += d
+
+    # 墓標が溜まったインデックスはバックグラウンドで物理削除する
+    from .compaction import schedule_compaction
+
+    schedule_compaction(groups)
+    return added, updated, deleted, stored_vector_count() or 0
+
+
+def rebuild_shard(key: str, folder_ids: str | None = None) -> Tuple[int, int, int, int]:
+    """シャードを破棄し、Boxから再構築する（他のシャードには触れない）。"""
+    if not sharding_enabled():
+        raise RuntimeError("VECTOR_SHARDING が none の場合はシャード再構築できません。")
+    if key == LOCAL_SHARD:
+        raise RuntimeError("ローカル追加分のシャードはBoxから再構築できません。")
+    folder_ids = folder_ids or get_settings().box_folder_ids
+    if not folder_ids:
+        raise RuntimeError("BOX_FOLDER_IDS を設定してください。")
+    with index_write_lock(shard_dir(key)):
+        evict_shard(key)
+        shutil.rmtree(shard_dir(key), ignore_errors=True)
+    return sync_box_folders(folder_ids, shards=[key])
 
 
 def _normalize_folder_id(value: str) -> str:
@@ -266,17 +343,24 @@ def _normalize_folder_id(value: str) -> str:
 
 def ingest_box_folder(folder_id: str) -> Tuple[int, int]:
     """指定フォルダ直下のPDFを取り込み、ベクタストアに反映する（再帰はしない）。"""
-    client = _get_box_client()
+    client = get_box_client()
     folder_id = _normalize_folder_id(folder_id)
     items = client.folder(folder_id=folder_id).get_items(limit=1000)
-    docs: List[Document] = []
+    by_shard: Dict[str | None, List[Document]] = {}
     for item in items:
         if getattr(item, "type", "") == "file" and str(item.name).lower().endswith(".pdf"):
             data = client.file(file_id=item.id).content()
-            docs.extend(pdf_bytes_to_documents(item.name, data))
-    if not docs:
-        return (0, load_or_create_index([]).index.ntotal)  # 何も追加なし
-    return upsert_documents(docs)
+            key = shard_key_for_file(folder_id, item.id) if sharding_enabled() else None
+            by_shard.setdefault(key, []).extend(pdf_bytes_to_documents(item.name, data))
+    docs = [d for chunk in by_shard.values() for d in chunk]
+    if not sharding_enabled():
+        if not docs:
+            return (0, load_or_create_index([]).index.ntotal)  # 何も追加なし
+        return upsert_documents(docs)
+    for key, shard_docs in by_shard.items():
+        if shard_docs:
+            upsert_documents(shard_docs, shard=key)
+    return len(docs), stored_vector_count() or 0
 
 
 def ingest_box_folders(folder_ids: str) -> Tuple[int, int]:
@@ -292,24 +376,34 @@ def ingest_box_folders(folder_ids: str) -> Tuple[int, int]:
 # =============================
 # Box アップロード
 # =============================
-def upload_files_to_box(folder_id: str, files: List[Tuple[str, bytes]]) -> List[str]:
-    """ローカルのファイルバイト列をBoxの指定フォルダにアップロードする。
+def upload_files_to_box(
+    folder_id: str,
+    files: List[Tuple[str, bytes]],
+    on_progress: Callable[[int, int], None] | None = None,
+) -> List[str]:
+    """ローカルのファイルバイト列をBoxの指定フォルダに並列アップロードする。
+
+    大きなファイルは分割アップロード（パート並列・失敗時再開）を使う。
 
     Args:
         folder_id: アップロード先のBoxフォルダID
         files: (ファイル名, バイト列) のリスト
+        on_progress: (送信済みバイト, 総バイト) を受け取る進捗コールバック
+            （呼び出し元スレッドで実行）
 
     Returns:
         生成されたBoxファイルIDのリスト
     """
-    client = _get_box_client()
+    client = get_box_client()
     folder_id = _normalize_folder_id(folder_id)
-    uploaded_ids: List[str] = []
-    for name, data in files:
-        stream = io.BytesIO(data)
-        item = client.folder(folder_id=folder_id).upload_stream(stream, file_name=name)
-        uploaded_ids.append(item.id)
-    return uploaded_ids
+    results = UploadManager(client).upload(folder_id, files, on_progress=on_progress)
+    failed = [r for r in results if r.error is not None]
+    if failed:
+        names = ", ".join(r.name for r in failed)
+        raise RuntimeError(
+            f"アップロードに失敗したファイルがあります: {names}"
+        ) from failed[0].error
+    return [r.file_id for r in results if r.file_id]
 
 
 def list_box_items(folder_id: str, limit: int = 500, offset: int = 0) -> List[Dict[str, Any]]:
@@ -317,7 +411,7 @@ def list_box_items(folder_id: str, limit: int = 500, offset: int = 0) -> List[Di
 
     Note: limit/offset はベストエフォート。大量アイテムの場合は繰り返し呼び出して集計してください。
     """
-    client = _get_box_client()
+    client = get_box_client()
     folder_id = _normalize_folder_id(folder_id)
     items = client.folder(folder_id=folder_id).get_items(
         limit=limit,
@@ -340,7 +434,7 @@ def list_box_items(folder_id: str, limit: int = 500, offset: int = 0) -> List[Di
 
 def list_box_pdfs(folder_id: str, recursive: bool = False, limit: int = 1000, offset: int = 0) -> List[Dict[str, Any]]:
     """PDFファイル一覧を取得。recursive=True で配下を再帰的に列挙。"""
-    client = _get_box_client()
+    client = get_box_client()
     if recursive:
         return _list_box_pdfs_recursive(client, folder_id)
     rows: List[Dict[str, Any]] = []
@@ -0,0 +1,326 @@
+"""Box 同期マニフェスト（SQLite）。
+
+インデックスディレクトリごとに ``box_manifest.sqlite3`` を持ち、
+ファイル単位でトランザクション更新する。
+テーブル:
+- files: ファイルID・親フォルダID・名前・フィンガープリント・世代
+- chunks: ベクトルID とファイル/チャンク番号の対応（ファイル単位の検索用インデックス付き）
+- folders: 同期済みフォルダと親フォルダ
+- tombstones: 論理削除したベクトルID（検索時に除外し、コンパクションで物理削除して purged=1 にする）
+- meta: 同期世代（generation）などのキー/値
+
+旧形式の ``box_manifest.json`` が残っていれば初回オープン時に取り込み、``.migrated`` に改名する。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+MANIFEST_DB = "box_manifest.sqlite3"
+LEGACY_MANIFEST_JSON = "box_manifest.json"
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS folders (
+    folder_id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    synced_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    folder_id TEXT,
+    name TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    generation INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_folder ON files(folder_id);
+CREATE TABLE IF NOT EXISTS chunks (
+    vector_id TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL REFERENCES files(file_id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks(file_id, chunk_index);
+CREATE TABLE IF NOT EXISTS tombstones (
+    vector_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    purged INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tombstones_live ON tombstones(purged);
+"""
+
+
+def manifest_path(vector_dir: str) -> Path:
+    return Path(vector_dir) / MANIFEST_DB
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def vector_id(file_id: str, generation: int, chunk_index: int) -> str:
+    """同期で使うベクトルID ``box:<file_id>@<generation>:<chunk_index>``。
+
+    世代を含めることで、更新前のベクトル（墓標付き）と更新後のベクトルが同じインデックスに共存できる。
+    """
+    return f"box:{file_id}@{generation}:{chunk_index}"
+
+
+def _chunk_index(vector_id: str, default: int) -> int:
+    """``box:<file_id>[@<generation>]:<chunk_index>`` 形式のIDからチャンク番号を取り出す。"""
+    try:
+        return int(str(vector_id).rsplit(":", 1)[1])
+    except (IndexError, ValueError):
+        return default
+
+
+class Manifest:
+    """1つのインデックスディレクトリに対応する同期マニフェスト。"""
+
+    def __init__(self, vector_dir: str) -> None:
+        self.vector_dir = vector_dir
+        self.path = manifest_path(vector_dir)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        self._migrate_legacy_json()
+
+    # ---- 接続管理 ----
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # ---- 参照 ----
+    def fingerprints(self) -> Dict[str, str]:
+        """file_id -> fingerprint（差分判定用）。"""
+        return {r[0]: r[1] for r in self._conn.execute("SELECT file_id, fingerprint FROM files")}
+
+    def files_by_folder(self, folder_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT * FROM files WHERE folder_id = ? ORDER BY name", (folder_id,)
+        )
+        return [dict(r) for r in rows]
+
+    def vector_ids(self, file_id: str) -> List[str]:
+        rows = self._conn.execute(
+            "SELECT vector_id FROM chunks WHERE file_id = ? ORDER BY chunk_index", (file_id,)
+        )
+        return [r[0] for r in rows]
+
+    def file_count(self) -> int:
+        return int(self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0])
+
+    def chunk_count(self) -> int:
+        return int(self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0])
+
+    def tombstones(self) -> List[str]:
+        """未パージの墓標（検索から除外すべきベクトルID）。"""
+        rows = self._conn.execute("SELECT vector_id FROM tombstones WHERE purged = 0")
+        return [r[0] for r in rows]
+
+    def tombstone_count(self) -> int:
+        row = self._conn.execute("SELECT COUNT(*) FROM tombstones WHERE purged = 0").fetchone()
+        return int(row[0])
+
+    def vector_ids_since(self, generation: int) -> Set[str]:
+        """generation より後の世代で追加/更新されたファイルのベクトルID。"""
+        rows = self._conn.execute(
+            "SELECT c.vector_id FROM chunks c JOIN files f ON f.file_id = c.file_id "
+            "WHERE f.generation > ?",
+            (generation,),
+        )
+        return {r[0] for r in rows}
+
+    def tombstones_since(self, generation: int) -> List[str]:
+        """generation より後の世代で墓標が付いたベクトルID（パージ済みを含む）。"""
+        rows = self._conn.execute(
+            "SELECT vector_id FROM tombstones WHERE generation > ?", (generation,)
+        )
+        return [r[0] for r in rows]
+
+    def generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    # ---- 更新 ----
+    def bump_generation(self) -> int:
+        """同期世代を1つ進めて新しい値を返す。"""
+        with self.transaction() as conn:
+            gen = self.generation() + 1
+            conn.execute(
+                "INSERT INTO meta(key, value) VALUES('generation', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(gen),),
+            )
+        return gen
+
+    def upsert_file(
+        self,
+        file_id: str,
+        folder_id: Optional[str],
+        name: str,
+        fingerprint: str,
+        vector_ids: List[str],
+        generation: Optional[int] = None,
+    ) -> None:
+        """ファイル1件分（メタ情報とチャンク対応）を置き換える。
+
+        置き換えで使われなくなったベクトルIDには墓標を付け、vector_ids に付いていた墓標
+        （add_tombstones で事前に付けた「反映待ち」の印）は外す。
+        """
+        gen = self.generation() if generation is None else generation
+        with self.transaction() as conn:
+            self._write_file(conn, file_id, folder_id, name, fingerprint, vector_ids, gen)
+
+    @staticmethod
+    def _write_file(
+        conn: sqlite3.Connection,
+        file_id: str,
+        folder_id: Optional[str],
+        name: str,
+        fingerprint: str,
+        vector_ids: List[str],
+        generation: int,
+    ) -> None:
+        rows = conn.execute("SELECT vector_id FROM chunks WHERE file_id = ?", (file_id,))
+        previous = [r[0] for r in rows]
+        keep = set(vector_ids)
+        Manifest._insert_tombstones(conn, [v for v in previous if v not in keep], generation)
+        conn.executemany("DELETE FROM tombstones WHERE vector_id = ?", [(v,) for v in vector_ids])
+        conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+        conn.execute(
+            "INSERT INTO files(file_id, folder_id, name, fingerprint, generation, updated_at) "
+            "VALUES(?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(file_id) DO UPDATE SET folder_id = excluded.folder_id, "
+            "name = excluded.name, fingerprint = excluded.fingerprint, "
+            "generation = excluded.generation, updated_at = excluded.updated_at",
+            (file_id, folder_id, name, fingerprint, generation, _now()),
+        )
+        conn.executemany(
+            "INSERT INTO chunks(vector_id, file_id, chunk_index) VALUES(?, ?, ?)",
+            [(vid, file_id, _chunk_index(vid, i)) for i, vid in enumerate(vector_ids)],
+        )
+
+    def delete_file(self, file_id: str, generation: Optional[int] = None) -> List[str]:
+        """ファイルを削除し、紐づいていたベクトルIDに墓標を付けて返す。"""
+        gen = self.generation() if generation is None else generation
+        with self.transaction() as conn:
+            ids = self.vector_ids(file_id)
+            self._insert_tombstones(conn, ids, gen)
+            conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+        return ids
+
+    @staticmethod
+    def _insert_tombstones(conn: sqlite3.Connection, ids: List[str], generation: int) -> None:
+        now = _now()
+        conn.executemany(
+            "INSERT INTO tombstones(vector_id, generation, purged, created_at) VALUES(?, ?, 0, ?) "
+            "ON CONFLICT(vector_id) DO UPDATE SET purged = 0, generation = excluded.generation",
+            [(v, generation, now) for v in ids],
+        )
+
+    def add_tombstones(self, ids: List[str], generation: Optional[int] = None) -> None:
+        """ベクトルIDに墓標を付ける（検索から即時に除外される）。"""
+        if not ids:
+            return
+        gen = self.generation() if generation is None else generation
+        with self.transaction() as conn:
+            self._insert_tombstones(conn, ids, gen)
+
+    def mark_purged(self, ids: List[str]) -> None:
+        """コンパクションで物理削除した墓標を purged にする（差分エクスポート用に行は残す）。"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE tombstones SET purged = 1 WHERE vector_id = ?", [(v,) for v in ids]
+            )
+
+    def mark_folders_synced(self, folders: Dict[str, Optional[str]]) -> None:
+        """folder_id -> parent_id を同期済みとして記録する。"""
+        now = _now()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO folders(folder_id, parent_id, synced_at) VALUES(?, ?, ?) "
+                "ON CONFLICT(folder_id) DO UPDATE SET parent_id = excluded.parent_id, "
+                "synced_at = excluded.synced_at",
+                [(fid, parent, now) for fid, parent in folders.items()],
+            )
+
+    # ---- 複製（スナップショット用） ----
+    def backup_to(self, path: str) -> None:
+        """一貫した時点のコピーを path に書き出す（SQLite のオンラインバックアップ）。"""
+        with self._lock:
+            dst = sqlite3.connect(path)
+            try:
+                self._conn.backup(dst)
+            finally:
+                dst.close()
+
+    def restore_from(self, path: str) -> None:
+        """path のマニフェストで内容を置き換える。"""
+        with self._lock:
+            src = sqlite3.connect(path)
+            try:
+                src.backup(self._conn)
+            finally:
+                src.close()
+
+    # ---- 旧形式からの移行 ----
+    def _migrate_legacy_json(self) -> None:
+        legacy = Path(self.vector_dir) / LEGACY_MANIFEST_JSON
+        if not legacy.exists() or self.file_count() > 0:
+            return
+        try:
+            data = json.loads(legacy.read_text(encoding="utf-8"))
+        except Exception:
+            logger.warning("旧マニフェストを読み込めませんでした（移行をスキップ）: %s", legacy)
+            return
+        with self.transaction() as conn:
+            for file_id, entry in data.items():
+                self._write_file(
+                    conn,
+                    file_id,
+                    entry.get("folder_id"),
+                    entry.get("name", ""),
+                    entry.get("fingerprint", ""),
+                    list(entry.get("vector_ids", [])),
+                    0,
+                )
+        legacy.rename(legacy.with_name(LEGACY_MANIFEST_JSON + ".migrated"))
+        logger.info("旧マニフェストを移行しました: %s (%d files)", legacy, len(data))
+
+
+__all__ = ["Manifest", "MANIFEST_DB", "manifest_path", "vector_id"]
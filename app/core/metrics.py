@@ -0,0 +1,43 @@
+"""プロセス内の簡易メトリクス（カウンタと観測値の合計/件数）。"""
+
+from __future__ import annotations
+
+import threading
+from typing import Dict
+
+_values: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def incr(name: str, value: float = 1) -> None:
+    """カウンタ name に value を加算する。"""
+    with _lock:
+        _values[name] = _values.get(name, 0) + value
+
+
+def observe(name: str, value: float) -> None:
+    """観測値を記録する（``<name>.count`` と ``<name>.sum`` に集計）。"""
+    with _lock:
+        _values[f"{name}.count"] = _values.get(f"{name}.count", 0) + 1
+        _values[f"{name}.sum"] = _values.get(f"{name}.sum", 0) + value
+
+
+def average(name: str) -> float | None:
+    """observe で記録した値の平均（未記録なら None）。"""
+    with _lock:
+        count = _values.get(f"{name}.count", 0)
+        return _values.get(f"{name}.sum", 0) / count if count else None
+
+
+def snapshot(prefix: str = "") -> Dict[str, float]:
+    with _lock:
+        return {k: v for k, v in sorted(_values.items()) if k.startswith(prefix)}
+
+
+def reset(prefix: str = "") -> None:
+    with _lock:
+        for k in [k for k in _values if k.startswith(prefix)]:
+            del _values[k]
+
+
+__all__ = ["incr", "observe", "average", "snapshot", "reset"]
@@ -0,0 +1,160 @@
+"""オプトインのプロファイリング（質問1件・同期1回ごとにフレームグラフを保存）。
+
+PROFILING=true、または画面の「プロファイルを記録」をオンにすると、対象の処理を
+サンプリングプロファイラ（pyinstrument、任意依存）の下で実行し、PROFILES_DIR に
+``<日時>_<名前>.html``（フレームグラフ）と ``.speedscope.json``
+（https://www.speedscope.app 用）を保存する。
+保存数が PROFILES_KEEP を超えたら古い実行分から削除する。
+
+pyinstrument は呼び出し元スレッドしか計測しないため、記録中（profiling_active()）は
+検索などをスレッドプールに渡さず呼び出し元スレッドで実行する。
+pyinstrument が無い場合は警告を出してプロファイルなしで実行する。
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from . import metrics
+from .config import get_settings
+from .utils import ensure_dir
+
+HTML_SUFFIX = ".html"
+SPEEDSCOPE_SUFFIX = ".speedscope.json"
+_INTERVAL = 0.001  # サンプリング間隔（秒）
+_lock = threading.Lock()
+_active: ContextVar[bool] = ContextVar("profiling_active", default=False)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProfileRun:
+    """1回分のプロファイル結果（無効時はパスが None のまま）。"""
+
+    name: str
+    html_path: Optional[Path] = None
+    speedscope_path: Optional[Path] = None
+    elapsed_sec: float = 0.0
+    files: List[Path] = field(default_factory=list)
+
+
+def profiling_enabled(override: Optional[bool] = None) -> bool:
+    """override（画面のトグル等）が指定されればそれを、なければ PROFILING を使う。"""
+    return get_settings().profiling if override is None else override
+
+
+def profiling_active() -> bool:
+    """このスレッドの処理がプロファイル記録中か（処理を呼び出し元スレッドで行うかの判定用）。"""
+    return _active.get()
+
+
+def _import_profiler():
+    """(Profiler, SpeedscopeRenderer) を返す。pyinstrument が無ければ警告して None。"""
+    try:
+        from pyinstrument import Profiler  # type: ignore
+        from pyinstrument.renderers import SpeedscopeRenderer  # type: ignore
+    except Exception:
+        logger.warning(
+            "pyinstrument が見つからないため、プロファイルなしで実行します"
+            "（`pip install pyinstrument` で有効になります）。"
+        )
+        return None
+    return Profiler, SpeedscopeRenderer
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_-]+", "-", name).strip("-") or "run"
+
+
+def prune_profiles(keep: Optional[int] = None) -> int:
+    """新しい keep 実行分を残して古いプロファイルを削除する。削除したファイル数を返す。"""
+    keep = get_settings().profiles_keep if keep is None else keep
+    root = Path(get_settings().profiles_dir)
+    if not root.exists():
+        return 0
+    runs = sorted(root.glob(f"*{HTML_SUFFIX}"), key=lambda p: p.stat().st_mtime, reverse=True)
+    removed = 0
+    for html in runs[max(0, keep) :]:
+        stem = html.name[: -len(HTML_SUFFIX)]
+        for p in (html, html.with_name(stem + SPEEDSCOPE_SUFFIX)):
+            try:
+                p.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def list_profiles(limit: int = 20) -> List[Path]:
+    """保存済みプロファイル（HTML）を新しい順に返す。"""
+    root = Path(get_settings().profiles_dir)
+    if not root.exists():
+        return []
+    runs = sorted(root.glob(f"*{HTML_SUFFIX}"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return runs[:limit]
+
+
+@contextmanager
+def profile_run(name: str, enabled: Optional[bool] = None) -> Iterator[ProfileRun]:
+    """ブロック内の処理をプロファイルし、終了時にファイルへ保存する。
+
+    with profile_run("qa") as run:
+        chain.invoke(q)
+    run.html_path  # 無効時は None
+
+    プロファイラはブロックを実行したスレッドをサンプリングする（記録中は profiling_active()
+    が True になる）。同時に1件のみ記録し、他の実行中に呼ばれた場合や pyinstrument が
+    無い場合はプロファイルせずに処理だけを行う。
+    """
+    run = ProfileRun(name=name)
+    started = time.perf_counter()
+    classes = _import_profiler() if profiling_enabled(enabled) else None
+    if classes is None or not _lock.acquire(blocking=False):
+        yield run
+        run.elapsed_sec = round(time.perf_counter() - started, 3)
+        return
+    Profiler, SpeedscopeRenderer = classes
+    token = _active.set(True)
+    try:
+        profiler = Profiler(interval=_INTERVAL)
+        profiler.start()
+        try:
+            yield run
+        finally:
+            profiler.stop()
+            run.elapsed_sec = round(time.perf_counter() - started, 3)
+            root = Path(get_settings().profiles_dir)
+            ensure_dir(str(root))
+            stem = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{_slug(name)}"
+            run.html_path = root / (stem + HTML_SUFFIX)
+            run.speedscope_path = root / (stem + SPEEDSCOPE_SUFFIX)
+            run.html_path.write_text(profiler.output_html(), encoding="utf-8")
+            run.speedscope_path.write_text(
+                profiler.output(renderer=SpeedscopeRenderer()), encoding="utf-8"
+            )
+            run.files = [run.html_path, run.speedscope_path]
+            metrics.incr(f"profiling.{_slug(name)}.runs")
+            prune_profiles()
+    finally:
+        _active.reset(token)
+        _lock.release()
+
+
+__all__ = [
+    "ProfileRun",
+    "list_profiles",
+    "profile_run",
+    "profiling_active",
+    "profiling_enabled",
+    "prune_profiles",
+]
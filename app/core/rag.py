@@ -1,22 +1,39 @@
 from __future__ import annotations
 
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
 from pathlib import Path
 
-from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
 
 from .config import get_settings
-from .ingest import build_embeddings
+from .context import pack_context
+from .retrieval_server import get_retrieval_client
+from .shards import load_index, lookup_document, search_documents, sharding_enabled
 
 
 def get_retriever():
     settings = get_settings()
-    vs = FAISS.load_local(settings.vector_dir, build_embeddings(), allow_dangerous_deserialization=True)
-    return vs.as_retriever(search_kwargs={"k": settings.top_k})
+    client = get_retrieval_client()
+    if client is not None:
+        # 検索サーバ（インデックスを保持するプロセス）へ問い合わせるだけの薄いクライアント
+        return RunnableLambda(lambda q: client.search_documents(q, settings.top_k)).with_config(
+            run_name="RemoteRetriever"
+        )
+    if sharding_enabled():
+        # 全シャードを並列検索し、スコア順に TOP_K 件へマージ
+        return RunnableLambda(lambda q: search_documents(q, settings.top_k)).with_config(
+            run_name="ShardedRetriever"
+        )
+    if load_index(settings.vector_dir) is None:
+        raise FileNotFoundError(f"インデックスが見つかりません: {settings.vector_dir}")
+    # as_retriever() は墓標（論理削除）を考慮しないため、単一構成でも同じ検索経路を使う
+    return RunnableLambda(lambda q: search_documents(q, settings.top_k)).with_config(
+        run_name="FAISSRetriever"
+    )
 
 
 def format_docs(docs):
@@ -28,6 +45,18 @@ def format_docs(docs):
     return "\n\n".join(parts)
 
 
+def assemble_context(docs):
+    """重なったチャンクを結合し、CONTEXT_TOKEN_BUDGET 内に関連度順で詰める。"""
+    settings = get_settings()
+    client = get_retrieval_client()
+    return pack_context(
+        docs,
+        budget=settings.context_token_budget,
+        expand_neighbors=settings.context_expand_neighbors,
+        lookup=client.lookup_document if client is not None else lookup_document,
+    )
+
+
 def build_llm():
     settings = get_settings()
     if settings.llm_provider != "bedrock":
@@ -43,10 +72,14 @@ def build_llm():
     return ChatBedrock(model=settings.llm_model, region_name=settings.aws_region, temperature=0)
 
 
-def build_chain():
-    settings = get_settings()
-    llm = build_llm()
+@lru_cache(maxsize=1)
+def get_llm():
+    """プロセス共有の LLM クライアント。"""
+    return build_llm()
 
+
+@lru_cache(maxsize=1)
+def _load_prompts() -> Tuple[str, str]:
     # パッケージ相対でプロンプトを解決（実行場所に依存しない）
     prompts_dir = Path(__file__).resolve().parents[1] / "prompts"
     system_path = prompts_dir / "system_ja.md"
@@ -55,6 +88,13 @@ def build_chain():
         system_text = f.read()
     with open(answer_path, "r", encoding="utf-8") as f:
         answer_text = f.read()
+    return system_text, answer_text
+
+
+def build_chain():
+    settings = get_settings()
+    llm = get_llm()
+    system_text, answer_text = _load_prompts()
 
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -63,9 +103,15 @@ def build_chain():
         ]
     )
 
-    retriever = get_retriever()
+    context_chain = get_retriever() | RunnableLambda(assemble_context)
+
+    def _with_context(question: str, config: RunnableConfig) -> Dict[str, str]:
+        # 検索は呼び出し元スレッドで行う（{"context": ..., "question": ...} の並列実行は
+        # 検索を別スレッドに移すため、プロファイラのフレームグラフに現れない）
+        return {"context": context_chain.invoke(question, config), "question": question}
+
     chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
+        RunnableLambda(_with_context)
         | prompt
         | llm
         | StrOutputParser()
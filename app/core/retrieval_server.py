@@ -0,0 +1,360 @@
+"""ローカル検索サーバ（インデックスを1プロセスで保持し、同時のクエリをまとめて検索する）。
+
+起動::
+
+    python -m app.cli serve-retrieval [--host 127.0.0.1 --port 8765 | --socket /tmp/box-rag.sock]
+
+RETRIEVAL_SERVER_URL を設定すると、Streamlit/CLI 側の get_retriever() はこのサーバへの
+薄いクライアントになり、UI プロセスではインデックスをロードしない。
+
+サーバは到着したクエリを RETRIEVAL_BATCH_WINDOW_MS だけ待って最大 RETRIEVAL_BATCH_MAX 件に束ね、
+埋め込みをまとめて計算したうえで、シャードごとに1回の ``index.search`` で全クエリを検索する。
+
+エンドポイント（JSON）:
+- POST /search  {"query": "...", "k": 5} または {"queries": [...], "k": 5}
+  -> {"results": [[hit, ...], ...]}
+- GET  /document?id=<vector_id> -> {"document": hit | null}
+- GET  /health -> {"status": "ok", ...}
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+from . import metrics
+from .config import get_settings
+
+if TYPE_CHECKING:  # pragma: no cover
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_TIMEOUT = 60.0  # 1リクエストあたりの待ち時間の上限（秒）
+
+
+# =============================
+# サーバ側: マイクロバッチ
+# =============================
+@dataclass
+class _Query:
+    text: str
+    k: int
+    future: "Future[List[Tuple[Document, float]]]" = field(default_factory=Future)
+
+
+def embed_queries(
+    texts: List[str], executor: Optional[ThreadPoolExecutor] = None
+) -> List[List[float]]:
+    """複数クエリを埋め込む（同一文字列は1回だけ計算）。
+
+    Bedrock にはクエリの一括埋め込み API がないため、executor があれば並列に呼び出す。
+    """
+    from .ingest import get_embeddings
+
+    embeddings = get_embeddings()
+    unique = list(dict.fromkeys(texts))
+    if executor is None or len(unique) == 1:
+        vectors = [embeddings.embed_query(t) for t in unique]
+    else:
+        vectors = list(executor.map(embeddings.embed_query, unique))
+    by_text = dict(zip(unique, vectors, strict=True))
+    return [by_text[t] for t in texts]
+
+
+class MicroBatcher:
+    """到着したクエリを短時間ためて、埋め込みと FAISS 検索をまとめて実行する。"""
+
+    def __init__(self, window_ms: int, max_batch: int, embed_workers: int = 4) -> None:
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[_Query]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="embed")
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, k: int) -> "Future[List[Tuple[Document, float]]]":
+        q = _Query(text, k)
+        self._queue.put(q)
+        return q.future
+
+    def _collect(self) -> List[_Query]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            self._run(self._collect())
+
+    def _run(self, batch: List[_Query]) -> None:
+        from .shards import search_batch_by_vectors
+
+        started = time.perf_counter()
+        try:
+            vectors = embed_queries([q.text for q in batch], self._executor)
+            results = search_batch_by_vectors(vectors, max(q.k for q in batch))
+            for q, hits in zip(batch, results, strict=True):
+                q.future.set_result(hits[: q.k])
+        except Exception as e:
+            for q in batch:
+                if not q.future.done():
+                    q.future.set_exception(e)
+        metrics.observe("retrieval_server.batch_size", len(batch))
+        metrics.observe("retrieval_server.batch_ms", (time.perf_counter() - started) * 1000)
+
+
+# =============================
+# サーバ側: HTTP
+# =============================
+def _doc_to_dict(doc: Document, score: Optional[float] = None) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "id": getattr(doc, "id", None),
+        "page_content": doc.page_content,
+        "metadata": doc.metadata,
+    }
+    if score is not None:
+        data["score"] = score
+    return data
+
+
+def _doc_from_dict(data: Dict[str, Any]) -> Document:
+    from langchain_core.documents import Document
+
+    return Document(
+        page_content=data["page_content"], metadata=data.get("metadata") or {}, id=data.get("id")
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "BoxRAGRetrieval/1"
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    batcher: MicroBatcher  # serve() で設定
+
+    def address_string(self) -> str:  # Unix ソケットでは client_address が空文字
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            from .shards import index_dirs, stored_vector_count
+
+            self._send(
+                200,
+                {
+                    "status": "ok",
+                    "pid": os.getpid(),
+                    "index_dirs": len(index_dirs()),
+                    "vectors": stored_vector_count(),
+                    "metrics": metrics.snapshot("retrieval_server."),
+                },
+            )
+        elif url.path == "/document":
+            from .shards import lookup_document
+
+            doc_id = (parse_qs(url.query).get("id") or [""])[0]
+            doc = lookup_document(doc_id) if doc_id else None
+            self._send(200, {"document": _doc_to_dict(doc) if doc is not None else None})
+        else:
+            self._send(404, {"error": f"not found: {url.path}"})
+
+    def do_POST(self) -> None:
+        if urlsplit(self.path).path != "/search":
+            self._send(404, {"error": f"not found: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            queries = body.get("queries") or [body["query"]]
+            k = int(body.get("k") or get_settings().top_k)
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {"error": f"不正なリクエストです: {e}"})
+            return
+        metrics.incr("retrieval_server.requests")
+        try:
+            futures = [self.batcher.submit(str(q), k) for q in queries]
+            results = [f.result(timeout=_REQUEST_TIMEOUT) for f in futures]
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, {"results": [[_doc_to_dict(d, s) for d, s in hits] for hits in results]})
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, socket_path: Optional[str] = None) -> None:
+    """検索サーバを起動する（Ctrl+C で停止）。起動時に全インデックスをロードしておく。"""
+    from .shards import index_dirs, load_index
+
+    settings = get_settings()
+    for d in index_dirs():
+        load_index(d)
+    handler = type(
+        "RetrievalHandler",
+        (_Handler,),
+        {
+            "batcher": MicroBatcher(
+                settings.retrieval_batch_window_ms,
+                settings.retrieval_batch_max,
+                embed_workers=settings.retrieval_workers,
+            )
+        },
+    )
+    server: socketserver.BaseServer
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = _ThreadingUnixHTTPServer(socket_path, handler)
+        where = f"unix://{socket_path}"
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        where = f"http://{host}:{port}"
+    logger.info("検索サーバを起動しました: %s", where)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+# =============================
+# クライアント側
+# =============================
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class RetrievalClient:
+    """検索サーバへのクライアント（スレッドごとに keep-alive 接続を再利用）。"""
+
+    def __init__(self, url: str, timeout: float = _REQUEST_TIMEOUT) -> None:
+        self.url = url
+        self.timeout = timeout
+        parts = urlsplit(url)
+        if parts.scheme == "unix":
+            self._socket_path: Optional[str] = parts.path
+            self._host, self._port = "", 0
+        elif parts.scheme == "http":
+            self._socket_path = None
+            self._host, self._port = parts.hostname or "127.0.0.1", parts.port or 80
+        else:
+            raise RuntimeError(
+                f"RETRIEVAL_SERVER_URL の形式が不正です: {url}"
+                "（http://host:port または unix:///path を指定）"
+            )
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._socket_path:
+                conn = _UnixHTTPConnection(self._socket_path, self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(
+        self, method: str, path: str, payload: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        body = None
+        if payload is not None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):  # サーバ側で閉じられた keep-alive 接続は1回だけ張り直す
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = json.loads(resp.read() or b"{}")
+                break
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                conn.close()
+                self._local.conn = None
+                if attempt == 1:
+                    raise RuntimeError(
+                        f"検索サーバに接続できません: {self.url}"
+                        "（`python -m app.cli serve-retrieval` で起動してください）"
+                    ) from e
+        if resp.status != 200:
+            raise RuntimeError(
+                f"検索サーバがエラーを返しました ({resp.status}): {data.get('error')}"
+            )
+        return data
+
+    def search_with_scores(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        data = self._request("POST", "/search", {"query": query, "k": k})
+        return [(_doc_from_dict(h), float(h["score"])) for h in data["results"][0]]
+
+    def search_documents(self, query: str, k: int) -> List[Document]:
+        return [doc for doc, _ in self.search_with_scores(query, k)]
+
+    def lookup_document(self, doc_id: str) -> Optional[Document]:
+        data = self._request("GET", f"/document?id={quote(doc_id, safe='')}")
+        return _doc_from_dict(data["document"]) if data.get("document") else None
+
+    def health(self) -> Dict[str, Any]:
+        return self._request("GET", "/health")
+
+
+_clients: Dict[str, RetrievalClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_retrieval_client() -> Optional[RetrievalClient]:
+    """RETRIEVAL_SERVER_URL が設定されていればプロセス共有のクライアントを返す（未設定は None）。"""
+    url = get_settings().retrieval_server_url
+    if not url:
+        return None
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = RetrievalClient(url)
+        return _clients[url]
+
+
+__all__ = ["MicroBatcher", "RetrievalClient", "embed_queries", "get_retrieval_client", "serve"]
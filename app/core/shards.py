@@ -0,0 +1,393 @@
+"""FAISS インデックスのシャード管理とシャード横断検索。
+
+VECTOR_SHARDING=folder|hash の場合、インデックスは ``<VECTOR_DIR>/shards/<key>/`` に
+シャード単位で保存される。各シャードは独立してロード/再構築/メモリ解放できる。
+VECTOR_SHARDING=none（既定）の場合は ``VECTOR_DIR`` 直下の単一インデックスを1シャードとして扱う。
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Optional, Tuple
+
+from .config import get_settings
+from .profiling import profiling_active
+
+if TYPE_CHECKING:  # pragma: no cover
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+SHARDS_DIRNAME = "shards"
+LOCAL_SHARD = "local"  # ローカルPDF追加分の格納先シャード
+_INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+def sharding_mode() -> str:
+    mode = get_settings().vector_sharding
+    return mode if mode in ("folder", "hash") else "none"
+
+
+def sharding_enabled() -> bool:
+    return sharding_mode() != "none"
+
+
+def shard_root() -> Path:
+    return Path(get_settings().vector_dir) / SHARDS_DIRNAME
+
+
+def shard_dir(key: str) -> str:
+    return str(shard_root() / key)
+
+
+def shard_key_for_file(top_folder_id: str, file_id: str) -> str:
+    """ファイルの格納先シャードキーを返す（folder: トップレベルフォルダID / hash: バケット名）。"""
+    if sharding_mode() == "hash":
+        buckets = get_settings().vector_shard_buckets
+        return f"h{zlib.crc32(str(file_id).encode('utf-8')) % buckets:03d}"
+    return f"f{top_folder_id}"
+
+
+def list_shards() -> List[str]:
+    """保存済みのシャードキー一覧。"""
+    root = shard_root()
+    if not root.exists():
+        return []
+    return sorted(p.name for p in root.iterdir() if (p / "index.faiss").exists())
+
+
+def index_dirs() -> List[str]:
+    """検索対象となるインデックスディレクトリの一覧。"""
+    if not sharding_enabled():
+        return [get_settings().vector_dir]
+    return [shard_dir(key) for key in list_shards()]
+
+
+def _stamp(index_dir: str) -> Optional[Tuple[int, ...]]:
+    try:
+        return tuple(Path(index_dir, name).stat().st_mtime_ns for name in _INDEX_FILES)
+    except FileNotFoundError:
+        return None
+
+
+_LOAD_ATTEMPTS = 50
+
+
+def _torn(stamp: Tuple[int, ...]) -> bool:
+    """save_index の置き換え途中（新しい index.faiss と古い index.pkl の組）かどうか。
+
+    save_local は index.faiss → index.pkl の順に書くため、揃った組では pkl の方が新しい。
+    """
+    return stamp[1] < stamp[0]
+
+
+def _load_consistent(
+    index_dir: str, stamp: Tuple[int, ...]
+) -> Optional[Tuple[Tuple[int, ...], FAISS]]:
+    """index.faiss と index.pkl が同じ保存に由来する状態でロードする（消えていれば None）。
+
+    ロード中に save_index が走ると新旧のファイルを組み合わせて読んでしまい、
+    index_to_docstore_id の引き当てで KeyError になる。ロード前後でスタンプを比べ、
+    変わっていれば読み直す。
+    """
+    from langchain_community.vectorstores import FAISS
+
+    from .ingest import get_embeddings
+
+    current: Optional[Tuple[int, ...]] = stamp
+    for attempt in range(_LOAD_ATTEMPTS):
+        if current is None:
+            return None
+        if _torn(current) and attempt < _LOAD_ATTEMPTS - 1:
+            # もう一方の置き換えを待つ（手でコピーした等で順序が逆のままなら最後は読み込む）
+            time.sleep(0.01)
+            current = _stamp(index_dir)
+            continue
+        vs = FAISS.load_local(index_dir, get_embeddings(), allow_dangerous_deserialization=True)
+        after = _stamp(index_dir)
+        if after == current:
+            return current, vs
+        current = after
+    raise RuntimeError(f"インデックスが更新され続けているためロードできません: {index_dir}")
+
+
+class IndexCache:
+    """インデックスディレクトリ単位の FAISS キャッシュ（LRU）。
+
+    ディスク上のファイルが更新されていれば次回取得時に再ロードする。
+    max_items=0 の場合は件数制限なし。
+    """
+
+    def __init__(self, max_items: int = 0) -> None:
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Tuple[Tuple[int, ...], FAISS]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dir_locks: Dict[str, threading.Lock] = {}
+
+    def _dir_lock(self, index_dir: str) -> threading.Lock:
+        with self._lock:
+            return self._dir_locks.setdefault(index_dir, threading.Lock())
+
+    def get(self, index_dir: str) -> Optional[FAISS]:
+        stamp = _stamp(index_dir)
+        if stamp is None:
+            self.evict(index_dir)
+            return None
+        with self._lock:
+            cached = self._items.get(index_dir)
+            if cached and cached[0] == stamp:
+                self._items.move_to_end(index_dir)
+                return cached[1]
+        with self._dir_lock(index_dir):
+            # 他スレッドが先にロードしていれば再利用
+            with self._lock:
+                cached = self._items.get(index_dir)
+                if cached and cached[0] == stamp:
+                    return cached[1]
+            loaded = _load_consistent(index_dir, stamp)
+            if loaded is None:
+                self.evict(index_dir)
+                return None
+            stamp, vs = loaded
+            with self._lock:
+                self._items[index_dir] = (stamp, vs)
+                self._items.move_to_end(index_dir)
+                while self.max_items and len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+            return vs
+
+    def evict(self, index_dir: Optional[str] = None) -> None:
+        """指定ディレクトリ（省略時は全件）をメモリから解放する。"""
+        with self._lock:
+            if index_dir is None:
+                self._items.clear()
+            else:
+                self._items.pop(index_dir, None)
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._items.keys())
+
+
+_write_locks: Dict[str, threading.RLock] = {}
+_write_locks_guard = threading.Lock()
+
+
+def index_write_lock(index_dir: str) -> threading.RLock:
+    """インデックスを書き換える処理（同期・コンパクション）をディレクトリ単位で直列化するロック。"""
+    with _write_locks_guard:
+        return _write_locks.setdefault(str(Path(index_dir)), threading.RLock())
+
+
+def save_index(vs: FAISS, index_dir: str) -> None:
+    """インデックスを保存する（index_write_lock を取得した状態で呼ぶ）。
+
+    ``save_local`` は index.faiss と index.pkl を順に上書きするため、一時ディレクトリに
+    保存してからファイル単位で置き換え、読み込み側が書きかけのファイルを読まないようにする。
+    2つの置き換えの間に読まれた場合は IndexCache 側（_load_consistent）で検出して読み直す。
+    """
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".save-", dir=index_dir)
+    try:
+        vs.save_local(tmp)
+        for name in _INDEX_FILES:
+            os.replace(os.path.join(tmp, name), os.path.join(index_dir, name))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+_tombstone_cache: Dict[str, Tuple[Tuple[int, ...], FrozenSet[str]]] = {}
+_tombstone_lock = threading.Lock()
+
+
+def tombstones(index_dir: str) -> FrozenSet[str]:
+    """検索から除外するベクトルID（マニフェストの墓標）。DBファイルが変わった時だけ読み直す。"""
+    from .manifest import manifest_path
+
+    db = manifest_path(index_dir)
+    stamp: Tuple[int, ...] = ()
+    for p in (db, db.with_name(db.name + "-wal")):
+        try:
+            st = p.stat()
+            stamp += (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp += (0, 0)
+    if not stamp[0]:
+        return frozenset()
+    with _tombstone_lock:
+        cached = _tombstone_cache.get(index_dir)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    from .manifest import Manifest
+
+    with Manifest(index_dir) as manifest:
+        ids = frozenset(manifest.tombstones())
+    with _tombstone_lock:
+        _tombstone_cache[index_dir] = (stamp, ids)
+    return ids
+
+
+_cache: Optional[IndexCache] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_init_lock = threading.Lock()
+
+
+def get_index_cache() -> IndexCache:
+    global _cache
+    with _init_lock:
+        if _cache is None:
+            _cache = IndexCache(max_items=get_settings().vector_shard_cache)
+        return _cache
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _init_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_settings().retrieval_workers, thread_name_prefix="shard-search"
+            )
+        return _executor
+
+
+def load_index(index_dir: str) -> Optional[FAISS]:
+    """キャッシュ経由でインデックスをロード（未作成なら None）。"""
+    return get_index_cache().get(index_dir)
+
+
+def evict_shard(key: Optional[str] = None) -> None:
+    """シャードをメモリから解放する（key 省略時は全シャード）。"""
+    get_index_cache().evict(shard_dir(key) if key is not None else None)
+
+
+def read_ntotal(index_dir: str) -> Optional[int]:
+    """index.faiss のヘッダからベクトル数を読む（faiss/LangChain を読み込まずに済む）。
+
+    FAISS の保存形式は fourcc(4) + d(int32) + ntotal(int64) で始まる。
+    """
+    try:
+        with open(Path(index_dir) / "index.faiss", "rb") as f:
+            header = f.read(16)
+    except FileNotFoundError:
+        return None
+    if len(header) < 16:
+        return None
+    return int(struct.unpack("<q", header[8:16])[0])
+
+
+def stored_vector_count() -> Optional[int]:
+    """保存済みインデックスの総ベクトル数（未作成なら None）。"""
+    counts = [n for n in (read_ntotal(d) for d in index_dirs()) if n is not None]
+    return sum(counts) if counts else None
+
+
+def _is_descending(dirs: List[str]) -> bool:
+    """既定の FAISS は L2 距離（小さいほど類似）。内積の場合のみ降順。"""
+    from langchain_community.vectorstores.utils import DistanceStrategy
+
+    for d in dirs:
+        vs = load_index(d)
+        if vs is not None:
+            return vs.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT
+    return False
+
+
+def _merge(
+    hits: List[Tuple[Document, float]], k: int, descending: bool
+) -> List[Tuple[Document, float]]:
+    hits.sort(key=lambda pair: pair[1], reverse=descending)
+    return hits[:k]
+
+
+def search_with_scores(query: str, k: int) -> List[Tuple[Document, float]]:
+    """全シャードを並列に検索し、スコア順に上位 k 件へマージする。"""
+    from .ingest import get_embeddings
+
+    dirs = index_dirs()
+    if not dirs:
+        return []
+    return search_batch_by_vectors([get_embeddings().embed_query(query)], k)[0]
+
+
+def _search_batch_one(
+    index_dir: str, embeddings: List[List[float]], k: int
+) -> List[List[Tuple[Document, float]]]:
+    """1つのインデックスに対し、複数クエリを1回の index.search で検索する。
+
+    墓標付きのベクトルは結果から除外する（除外分を見込んで多めに取得する）。
+    """
+    import numpy as np
+    from langchain_core.documents import Document
+
+    vs = load_index(index_dir)
+    if vs is None or vs.index.ntotal == 0:
+        return [[] for _ in embeddings]
+    dead = tombstones(index_dir)
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if getattr(vs, "_normalize_L2", False):
+        from langchain_community.vectorstores.faiss import dependable_faiss_import
+
+        dependable_faiss_import().normalize_L2(vectors)
+    scores, indices = vs.index.search(vectors, min(k + len(dead), int(vs.index.ntotal)))
+    results: List[List[Tuple[Document, float]]] = []
+    for row_scores, row_ids in zip(scores, indices, strict=True):
+        hits: List[Tuple[Document, float]] = []
+        for score, i in zip(row_scores, row_ids, strict=True):
+            if i == -1:
+                continue
+            doc_id = vs.index_to_docstore_id[int(i)]
+            if doc_id in dead:
+                continue
+            doc = vs.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                hits.append((doc, float(score)))
+                if len(hits) == k:
+                    break
+        results.append(hits)
+    return results
+
+
+def search_batch_by_vectors(
+    embeddings: List[List[float]], k: int
+) -> List[List[Tuple[Document, float]]]:
+    """埋め込み済みの複数クエリを全シャードでまとめて検索し、クエリごとに上位 k 件を返す。"""
+    dirs = index_dirs()
+    if not dirs or not embeddings:
+        return [[] for _ in embeddings]
+    if len(dirs) == 1 or profiling_active():
+        # プロファイル記録中は呼び出し元スレッドで順に検索する（フレームグラフに現れるように）
+        per_dir = [_search_batch_one(d, embeddings, k) for d in dirs]
+    else:
+        futures = [_get_executor().submit(_search_batch_one, d, embeddings, k) for d in dirs]
+        per_dir = [f.result() for f in futures]
+    descending = _is_descending(dirs)
+    return [
+        _merge([hit for results in per_dir for hit in results[q]], k, descending)
+        for q in range(len(embeddings))
+    ]
+
+
+def search_documents(query: str, k: int) -> List[Document]:
+    return [doc for doc, _ in search_with_scores(query, k)]
+
+
+def lookup_document(doc_id: str) -> Optional[Document]:
+    """ID でドキュメントを引く（ロード済み/ロード可能な全シャードを対象）。"""
+    from langchain_core.documents import Document
+
+    for d in index_dirs():
+        vs = load_index(d)
+        if vs is None or doc_id in tombstones(d):
+            continue
+        doc = vs.docstore.search(doc_id)
+        if isinstance(doc, Document):
+            return doc
+    return None
@@ -0,0 +1,435 @@
+"""インデックスのスナップショット（他ノードへの複製用のエクスポート/インポート）。
+
+スナップショットは1つの tar アーカイブで、インデックスディレクトリ（単一構成では VECTOR_DIR、
+シャード構成では各シャード）ごとに次を含む:
+- vectors.npy: ベクトル（float32 または float16）。行番号が chunks.sqlite3 の row に対応
+- chunks.sqlite3: チャンク本文とメタデータ（chunks）、差分で削除すべきベクトルID（deleted）
+- box_manifest.sqlite3: 同期マニフェストのコピー
+先頭の meta.json に形式バージョン・世代・次元・件数と各ファイルの SHA-256 を記録し、
+アーカイブ全体の SHA-256 は ``<archive>.sha256`` に書き出す（インポート時に必須）。
+
+インポートは再埋め込みを行わず、vectors.npy を mmap で読みながら FAISS に追加する。
+完全スナップショットのインポートでは、スナップショットに含まれないシャードを削除する。
+since を指定したエクスポートは、その世代より後に変わったファイルのベクトルと削除IDだけを
+含む差分になる（差分が扱うのは Box 同期分のみ。ローカル追加分は完全スナップショットで複製する）。
+世代はインデックスごとに進むため、シャード構成で since より世代が古いシャードは空の差分になる。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from .config import get_settings
+from .manifest import MANIFEST_DB, Manifest
+from .shards import (
+    evict_shard,
+    index_dirs,
+    index_write_lock,
+    save_index,
+    sharding_enabled,
+    sharding_mode,
+)
+from .utils import ensure_dir
+
+if TYPE_CHECKING:  # pragma: no cover
+    from langchain_community.vectorstores import FAISS
+
+SNAPSHOT_FORMAT = "box-rag-snapshot"
+SNAPSHOT_VERSION = 1
+META_NAME = "meta.json"
+VECTORS_NAME = "vectors.npy"
+CHUNKS_NAME = "chunks.sqlite3"
+_DTYPES = ("float32", "float16")
+_BATCH = 65536  # reconstruct/add をこの行数ずつ行い、全件のコピーをメモリに持たない
+
+_CHUNKS_SCHEMA = """
+CREATE TABLE chunks (
+    row INTEGER PRIMARY KEY,
+    vector_id TEXT NOT NULL UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE deleted (
+    vector_id TEXT PRIMARY KEY
+);
+"""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _relative_name(index_dir: str) -> str:
+    rel = Path(index_dir).resolve().relative_to(Path(get_settings().vector_dir).resolve())
+    return rel.as_posix() or "."
+
+
+def _strategy_name(vs: FAISS) -> str:
+    return str(getattr(vs.distance_strategy, "value", vs.distance_strategy))
+
+
+# =============================
+# エクスポート
+# =============================
+def _export_index(
+    index_dir: str, out: Path, since: Optional[int], dtype: str
+) -> Optional[Dict[str, Any]]:
+    import numpy as np
+
+    from .ingest import _load_index_if_exists
+
+    with index_write_lock(index_dir):
+        vs = _load_index_if_exists(index_dir)
+        if vs is None:
+            return None
+        out.mkdir(parents=True)
+        with Manifest(index_dir) as manifest:
+            generation = manifest.generation()
+            if since is not None and since > generation:
+                if not sharding_enabled():
+                    raise RuntimeError(
+                        f"差分の基準世代 {since} が現在の世代 {generation} より新しいです: "
+                        f"{index_dir}"
+                    )
+                # このシャードは since 以降に変更がない: 自身の世代からの空の差分にする
+                since = generation
+            dead = set(manifest.tombstones())
+            wanted = manifest.vector_ids_since(since) if since is not None else None
+            deleted = manifest.tombstones_since(since) if since is not None else []
+            manifest.backup_to(str(out / MANIFEST_DB))
+
+        ntotal = int(vs.index.ntotal)
+        ids = [vs.index_to_docstore_id[i] for i in range(ntotal)]
+        positions = [
+            i for i, vid in enumerate(ids) if vid not in dead and (wanted is None or vid in wanted)
+        ]
+        dim = int(vs.index.d)
+
+        # ベクトル: 出力先を mmap で開き、バッチごとに復元して書き込む
+        if positions:
+            vectors = np.lib.format.open_memmap(
+                out / VECTORS_NAME, mode="w+", dtype=np.dtype(dtype), shape=(len(positions), dim)
+            )
+            for start in range(0, len(positions), _BATCH):
+                batch = np.asarray(positions[start : start + _BATCH], dtype=np.int64)
+                vectors[start : start + len(batch)] = vs.index.reconstruct_batch(batch)
+            vectors.flush()
+            del vectors
+        else:
+            np.save(out / VECTORS_NAME, np.zeros((0, dim), dtype=np.dtype(dtype)))
+
+        # 本文とメタデータ
+        conn = sqlite3.connect(str(out / CHUNKS_NAME))
+        try:
+            conn.executescript(_CHUNKS_SCHEMA)
+            rows = []
+            for row, pos in enumerate(positions):
+                doc = vs.docstore.search(ids[pos])
+                rows.append(
+                    (
+                        row,
+                        ids[pos],
+                        getattr(doc, "page_content", ""),
+                        json.dumps(
+                            getattr(doc, "metadata", {}) or {}, ensure_ascii=False, default=str
+                        ),
+                    )
+                )
+            conn.executemany("INSERT INTO chunks VALUES(?, ?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO deleted VALUES(?)", [(v,) for v in dict.fromkeys(deleted)]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        return {
+            "name": _relative_name(index_dir),
+            "kind": "full" if since is None else "delta",
+            "since": since,
+            "generation": generation,
+            "count": len(positions),
+            "deleted": len(set(deleted)),
+            "dim": dim,
+            "dtype": dtype,
+            "distance_strategy": _strategy_name(vs),
+            "normalize_L2": bool(getattr(vs, "_normalize_L2", False)),
+        }
+
+
+def _base_generations(base: str) -> Dict[str, int]:
+    """基準スナップショットの meta.json から、インデックス名 -> 世代 を読む。"""
+    with tarfile.open(base, "r") as tar:
+        member = tar.extractfile(META_NAME)
+        if member is None:
+            raise RuntimeError(f"スナップショットに {META_NAME} がありません: {base}")
+        meta = json.load(member)
+    return {entry["name"]: int(entry["generation"]) for entry in meta.get("indexes", [])}
+
+
+def export_snapshot(
+    path: str, since: Optional[int] = None, base: Optional[str] = None, dtype: str = "float32"
+) -> Dict[str, Any]:
+    """全インデックスをスナップショットとして path（tar）に書き出し、meta を返す。
+
+    since（全インデックス共通の世代）または base（基準スナップショット。インデックスごとの
+    世代を使う）を指定すると差分スナップショットになる。base にないインデックスは完全な形で含める。
+    """
+    if dtype not in _DTYPES:
+        raise RuntimeError(
+            f"dtype は {' / '.join(_DTYPES)} のいずれかを指定してください: {dtype}"
+        )
+    base_gens = _base_generations(base) if base else {}
+
+    meta: Dict[str, Any] = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": _now(),
+        "sharding": sharding_mode(),
+        "kind": "delta" if (since is not None or base) else "full",
+        "dtype": dtype,
+        "indexes": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as tmp:
+        staging = Path(tmp)
+        for n, index_dir in enumerate(index_dirs()):
+            member_dir = f"indexes/{n:04d}"
+            index_since = base_gens.get(_relative_name(index_dir)) if base else since
+            entry = _export_index(index_dir, staging / member_dir, index_since, dtype)
+            if entry is None:
+                continue
+            entry["path"] = member_dir
+            entry["files"] = {
+                name: _sha256(staging / member_dir / name)
+                for name in (VECTORS_NAME, CHUNKS_NAME, MANIFEST_DB)
+            }
+            meta["indexes"].append(entry)
+        if not meta["indexes"]:
+            raise RuntimeError(
+                "エクスポートするインデックスがありません。先に同期/取り込みを実行してください。"
+            )
+        (staging / META_NAME).write_text(
+            json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+
+        ensure_dir(str(Path(path).resolve().parent))
+        with tarfile.open(path, "w") as tar:
+            tar.add(staging / META_NAME, arcname=META_NAME)
+            for entry in meta["indexes"]:
+                tar.add(staging / entry["path"], arcname=entry["path"])
+    digest = _sha256(Path(path))
+    Path(f"{path}.sha256").write_text(f"{digest}  {Path(path).name}\n", encoding="utf-8")
+    meta["sha256"] = digest
+    return meta
+
+
+# =============================
+# インポート
+# =============================
+def _safe_extract(tar: tarfile.TarFile, dest: Path) -> None:
+    root = dest.resolve()
+    for member in tar.getmembers():
+        target = (dest / member.name).resolve()
+        inside = target == root or root in target.parents
+        if not (member.isfile() or member.isdir()) or not inside:
+            raise RuntimeError(f"スナップショットに不正なエントリがあります: {member.name}")
+    tar.extractall(dest)
+
+
+def _verify_archive(path: str) -> None:
+    """``<archive>.sha256`` と照合する（meta.json 自体を検証する手段はこれしかないため必須）。"""
+    sidecar = Path(f"{path}.sha256")
+    if not sidecar.exists():
+        raise RuntimeError(
+            f"チェックサムファイルがありません: {sidecar}"
+            "（エクスポート時に作成された .sha256 をスナップショットと同じ場所に置いてください）"
+        )
+    expected = sidecar.read_text(encoding="utf-8").split()[0]
+    if _sha256(Path(path)) != expected:
+        raise RuntimeError(f"スナップショットのチェックサムが一致しません: {path}")
+
+
+def _read_chunks(
+    chunks_path: Path,
+) -> Tuple[List[str], List[str], List[Dict[str, Any]], List[str]]:
+    conn = sqlite3.connect(str(chunks_path))
+    try:
+        rows = conn.execute(
+            "SELECT vector_id, page_content, metadata FROM chunks ORDER BY row"
+        ).fetchall()
+        deleted = [r[0] for r in conn.execute("SELECT vector_id FROM deleted")]
+    finally:
+        conn.close()
+    return [r[0] for r in rows], [r[1] for r in rows], [json.loads(r[2]) for r in rows], deleted
+
+
+def _load_vectors(path: Path, count: int) -> Any:
+    import numpy as np
+
+    if count == 0:
+        return np.load(path)
+    return np.load(path, mmap_mode="r")  # 行をバッチで読むだけなので全体をメモリに載せない
+
+
+def _build_full(entry: Dict[str, Any], src: Path) -> FAISS:
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.faiss import dependable_faiss_import
+    from langchain_community.vectorstores.utils import DistanceStrategy
+    from langchain_core.documents import Document
+
+    from .ingest import get_embeddings
+
+    faiss = dependable_faiss_import()
+    strategy = DistanceStrategy(entry["distance_strategy"])
+    dim = int(entry["dim"])
+    if strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        index = faiss.IndexFlatIP(dim)
+    else:
+        index = faiss.IndexFlatL2(dim)
+    vectors = _load_vectors(src / VECTORS_NAME, int(entry["count"]))
+    for start in range(0, len(vectors), _BATCH):
+        index.add(np.ascontiguousarray(vectors[start : start + _BATCH], dtype=np.float32))
+
+    ids, texts, metadatas, _ = _read_chunks(src / CHUNKS_NAME)
+    docstore = InMemoryDocstore(
+        {
+            vid: Document(page_content=t, metadata=m, id=vid)
+            for vid, t, m in zip(ids, texts, metadatas, strict=True)
+        }
+    )
+    return FAISS(
+        get_embeddings(),
+        index,
+        docstore,
+        dict(enumerate(ids)),
+        normalize_L2=bool(entry.get("normalize_L2")),
+        distance_strategy=strategy,
+    )
+
+
+def _apply_delta(entry: Dict[str, Any], src: Path, index_dir: str) -> FAISS:
+    import numpy as np
+
+    from .ingest import _load_index_if_exists
+
+    vs = _load_index_if_exists(index_dir)
+    if vs is None:
+        raise RuntimeError(f"差分スナップショットの適用先インデックスがありません: {index_dir}")
+    with Manifest(index_dir) as manifest:
+        current = manifest.generation()
+    if current < int(entry["since"]):
+        raise RuntimeError(
+            f"適用先の世代 {current} が差分の基準世代 {entry['since']} より古いです: {index_dir}"
+            "（先に基準となるスナップショットをインポートしてください）"
+        )
+
+    ids, texts, metadatas, deleted = _read_chunks(src / CHUNKS_NAME)
+    existing = set(vs.index_to_docstore_id.values())
+    remove = [vid for vid in dict.fromkeys(deleted + ids) if vid in existing]
+    if remove:
+        vs.delete(remove)  # 削除分と、同じIDで入れ直す分をまとめて1回で除去
+
+    vectors = _load_vectors(src / VECTORS_NAME, int(entry["count"]))
+    for start in range(0, len(ids), _BATCH):
+        end = start + _BATCH
+        batch = np.asarray(vectors[start:end], dtype=np.float32)
+        vs.add_embeddings(
+            list(zip(texts[start:end], batch, strict=True)),
+            metadatas=metadatas[start:end],
+            ids=ids[start:end],
+        )
+    return vs
+
+
+def _remove_index(index_dir: str) -> None:
+    """完全スナップショットに含まれないシャードを削除する（書き出し元で削除済み）。"""
+    with index_write_lock(index_dir):
+        evict_shard(Path(index_dir).name)
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def import_snapshot(path: str) -> Dict[str, Any]:
+    """スナップショットを VECTOR_DIR 配下に取り込む（再埋め込みなし）。取り込んだ内容の要約を返す。
+
+    完全スナップショットの場合、含まれないシャードは削除する（summary の removed）。
+    """
+    _verify_archive(path)
+    settings = get_settings()
+    summary: Dict[str, Any] = {"indexes": [], "removed": []}
+    ensure_dir(settings.vector_dir)
+    with tempfile.TemporaryDirectory(prefix=".snapshot-", dir=settings.vector_dir) as tmp:
+        staging = Path(tmp)
+        with tarfile.open(path, "r") as tar:
+            _safe_extract(tar, staging)
+        meta = json.loads((staging / META_NAME).read_text(encoding="utf-8"))
+        if meta.get("format") != SNAPSHOT_FORMAT or int(meta.get("version", 0)) > SNAPSHOT_VERSION:
+            raise RuntimeError(
+                "対応していないスナップショット形式です: "
+                f"{meta.get('format')} v{meta.get('version')}"
+            )
+        if meta.get("sharding") != sharding_mode():
+            raise RuntimeError(
+                f"シャード構成が異なります（スナップショット: {meta.get('sharding')} / "
+                f"このノード: {sharding_mode()}）。VECTOR_SHARDING を合わせてください。"
+            )
+        summary.update({k: meta.get(k) for k in ("created_at", "sharding", "dtype")})
+
+        for entry in meta["indexes"]:
+            src = staging / entry["path"]
+            for name, digest in entry["files"].items():
+                if _sha256(src / name) != digest:
+                    raise RuntimeError(f"チェックサムが一致しません: {entry['path']}/{name}")
+            index_dir = str(Path(settings.vector_dir) / entry["name"])
+            with index_write_lock(index_dir):
+                if entry["kind"] == "delta":
+                    vs = _apply_delta(entry, src, index_dir)
+                else:
+                    vs = _build_full(entry, src)
+                save_index(vs, index_dir)
+                with Manifest(index_dir) as manifest:
+                    manifest.restore_from(str(src / MANIFEST_DB))
+                    # スナップショットに含まれない（＝削除済みの）ベクトルの墓標は処理済みにする
+                    manifest.mark_purged(manifest.tombstones())
+            summary["indexes"].append(
+                {
+                    "name": entry["name"],
+                    "kind": entry["kind"],
+                    "generation": entry["generation"],
+                    "imported": entry["count"],
+                    "deleted": entry.get("deleted", 0),
+                    "total_vectors": int(vs.index.ntotal),
+                }
+            )
+
+        kind = meta.get("kind") or (
+            "full" if all(e["kind"] == "full" for e in meta["indexes"]) else "delta"
+        )
+        if kind == "full":
+            names = {entry["name"] for entry in meta["indexes"]}
+            for index_dir in index_dirs():
+                name = _relative_name(index_dir)
+                if name not in names:
+                    _remove_index(index_dir)
+                    summary["removed"].append(name)
+    return summary
+
+
+__all__ = ["SNAPSHOT_FORMAT", "SNAPSHOT_VERSION", "export_snapshot", "import_snapshot"]
@@ -2,10 +2,10 @@ from __future__ import annotations
 
 import io
 import os
-from typing import Iterable, List
+from typing import TYPE_CHECKING, Iterable, List
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+if TYPE_CHECKING:  # pragma: no cover
+    from langchain_core.documents import Document
 
 
 def ensure_dir(path: str) -> None:
@@ -17,6 +17,9 @@ def pdf_bytes_to_documents(name: str, data: bytes) -> List[Document]:
         from pypdf import PdfReader
     except Exception as e:
         raise RuntimeError("pypdf の読み込みに失敗しました。requirements.txt を確認してください。") from e
+    # 重い依存はページ表示時ではなく実際の取り込み時に読み込む
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
     reader = PdfReader(io.BytesIO(data))
     docs: List[Document] = []
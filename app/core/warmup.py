@@ -0,0 +1,86 @@
+"""バックグラウンドのウォームアップ（初回の質問/画面表示を速くする）。
+
+Streamlit の起動直後にデーモンスレッドで重いモジュールの import、インデックスのロード、
+Embeddings/LLM/Box クライアントの生成を済ませておく。失敗しても画面表示には影響させない。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from . import metrics
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_status: Dict[str, str] = {}
+
+
+def _step(name: str, fn) -> None:
+    started = time.perf_counter()
+    try:
+        fn()
+        _status[name] = "ok"
+    except Exception as e:  # ウォームアップの失敗は利用時に改めて表面化する
+        _status[name] = f"{type(e).__name__}: {e}"
+        logger.debug("ウォームアップ失敗 (%s): %s", name, e)
+    metrics.observe(f"warmup.{name}_ms", (time.perf_counter() - started) * 1000)
+
+
+def _load_indexes() -> None:
+    from .shards import index_dirs, load_index
+
+    if get_settings().retrieval_server_url:
+        return  # インデックスは検索サーバ側で保持する
+
+    for d in index_dirs():
+        load_index(d)
+
+
+def _build_llm() -> None:
+    from .rag import get_llm
+
+    get_llm()
+
+
+def _build_box_client() -> None:
+    settings = get_settings()
+    has_credentials = settings.box_client_id and settings.box_client_secret
+    if not (settings.box_developer_token or has_credentials):
+        return
+    from .box_client import get_box_client
+
+    get_box_client()
+
+
+def _run() -> None:
+    started = time.perf_counter()
+    _step("index", _load_indexes)  # Embeddings の生成と faiss/LangChain の import を含む
+    _step("llm", _build_llm)
+    _step("box", _build_box_client)
+    metrics.observe("warmup.total_ms", (time.perf_counter() - started) * 1000)
+
+
+def start_warmup() -> None:
+    """ウォームアップを開始する（プロセス内で1回だけ。2回目以降は何もしない）。"""
+    global _thread
+    if not get_settings().warmup:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+        _thread.start()
+
+
+def warmup_status() -> Dict[str, str]:
+    """ステップ名 -> "ok" またはエラー内容（未完了のステップは含まない）。"""
+    return dict(_status)
+
+
+__all__ = ["start_warmup", "warmup_status"]
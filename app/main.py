@@ -5,34 +5,42 @@ from pathlib import Path
 import streamlit as st
 
 from app.core.config import get_settings
+from app.core.warmup import start_warmup, warmup_status
 
 
 def _vector_count() -> int | None:
+    # インデックス本体はロードせず、ファイルヘッダから件数だけを読む
     try:
-        from langchain_community.vectorstores import FAISS
-        from app.core.ingest import build_embeddings
-    except Exception:
-        return None
+        from app.core.shards import stored_vector_count
 
-    settings = get_settings()
-    try:
-        vs = FAISS.load_local(settings.vector_dir, build_embeddings(), allow_dangerous_deserialization=True)
-        return int(getattr(vs.index, "ntotal", 0))
+        return stored_vector_count()
     except Exception:
         return None
 
 
 def _manifest_info() -> tuple[int | None, str | None]:
-    settings = get_settings()
-    p = Path(settings.vector_dir) / "box_manifest.json"
-    if not p.exists():
-        return (None, None)
     try:
-        import json, datetime
+        from app.core.manifest import MANIFEST_DB, Manifest
+        from app.core.shards import index_dirs
+    except Exception:
+        return (None, None)
 
-        data = json.loads(p.read_text(encoding="utf-8"))
-        file_count = len(data)
-        ts = datetime.datetime.fromtimestamp(p.stat().st_mtime).strftime("%Y-%m-%d %H:%M")
+    dirs = [
+        d
+        for d in index_dirs()
+        if (Path(d) / MANIFEST_DB).exists() or (Path(d) / "box_manifest.json").exists()
+    ]
+    if not dirs:
+        return (None, None)
+    try:
+        import datetime
+
+        file_count = 0
+        for d in dirs:
+            with Manifest(d) as manifest:
+                file_count += manifest.file_count()
+        mtime = max((Path(d) / MANIFEST_DB).stat().st_mtime for d in dirs)
+        ts = datetime.datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M")
         return (file_count, ts)
     except Exception:
         return (None, None)
@@ -40,6 +48,7 @@ def _manifest_info() -> tuple[int | None, str | None]:
 
 def main() -> None:
     st.set_page_config(page_title="ダッシュボード", layout="wide")
+    start_warmup()
 
     st.title("ダッシュボード")
     st.caption("アプリの状況と設定の概要を表示します。Q&Aや取り込み/同期は左のページから実行できます。")
@@ -63,6 +72,8 @@ def main() -> None:
         "\n".join(
             [
                 f"VECTOR保存先: {settings.vector_dir}",
+                f"シャード構成: {settings.vector_sharding}",
+                f"検索サーバ: {settings.retrieval_server_url or 'なし（プロセス内で検索）'}",
                 f"Embeddings/LLM: Bedrock（リージョン: {settings.aws_region or '-'}）",
                 f"BoxフォルダID: {settings.box_folder_ids or '-'}",
                 f"Box認証方式: {settings.box_auth_method or '-'}",
@@ -71,6 +82,33 @@ def main() -> None:
         )
     )
 
+    with st.expander("Box接続メトリクス（このプロセス）"):
+        try:
+            from app.core.box_client import box_client_metrics
+
+            st.json(box_client_metrics())
+        except Exception as e:
+            st.write(f"取得できませんでした: {e}")
+
+    with st.expander("保存済みプロファイル"):
+        from app.core.profiling import list_profiles
+
+        profiles = list_profiles()
+        if not profiles:
+            st.write(
+                "まだありません（PROFILING=true または各ページのトグルで記録、"
+                f"保存先: {settings.profiles_dir}）。"
+            )
+        for p in profiles:
+            st.download_button(
+                p.name, p.read_bytes(), file_name=p.name, mime="text/html", key=f"profile-{p.name}"
+            )
+
+    with st.expander("ウォームアップ（このプロセス）"):
+        from app.core import metrics
+
+        st.json({"status": warmup_status(), "timings_ms": metrics.snapshot("warmup.")})
+
     st.info("Q&A はサイドバーの『Q&A』ページ、取り込み/同期は『データ取り込み・同期』ページから実行してください。")
 
 
@@ -2,22 +2,62 @@ from __future__ import annotations
 
 import streamlit as st
 
-from app.core.rag import build_chain
+from app.core import metrics
+from app.core.config import get_settings
+from app.core.warmup import start_warmup
 
 
 st.set_page_config(page_title="Q&A", layout="wide")
+start_warmup()
 st.title("Q&A")
 st.caption("インデックス化済みの資料をもとに日本語で回答し、根拠も提示します。インデックスの作成・同期は左の『データ取り込み・同期』ページから実行できます。")
 
+with st.sidebar:
+    st.header("管理者向け")
+    profile_on = st.toggle(
+        "プロファイルを記録",
+        value=get_settings().profiling,
+        help="回答処理をサンプリングプロファイラで計測し、フレームグラフを保存します"
+        "（要 pyinstrument）。",
+    )
+
 st.subheader("質問")
 q = st.text_input("質問（日本語）", placeholder="例: 経費精算の締め切りはいつですか？")
 if st.button("回答する") and q.strip():
     try:
-        chain = build_chain()
-        with st.spinner("検索と回答を生成中…"):
-            answer = chain.invoke(q)
+        from app.core.profiling import profile_run
+
+        with st.spinner("検索と回答を生成中…"), profile_run("qa", enabled=profile_on) as prof:
+            # LangChain/FAISS の import は回答時まで遅らせる（ウォームアップ済みなら即時）
+            from app.core.rag import build_chain
+
+            answer = build_chain().invoke(q)
         st.markdown("### 回答")
         st.write(answer)
+        if prof.html_path is not None:
+            st.caption(f"プロファイル（{prof.elapsed_sec:.2f}s）: {prof.html_path.name}")
+            pcol1, pcol2 = st.columns(2)
+            pcol1.download_button(
+                "フレームグラフ（HTML）",
+                prof.html_path.read_bytes(),
+                file_name=prof.html_path.name,
+                mime="text/html",
+            )
+            pcol2.download_button(
+                "speedscope 用 JSON",
+                prof.speedscope_path.read_bytes(),
+                file_name=prof.speedscope_path.name,
+                mime="application/json",
+            )
+        raw, packed = (
+            metrics.average("prompt.context_tokens_raw"),
+            metrics.average("prompt.context_tokens_packed"),
+        )
+        if raw and packed is not None:
+            st.caption(
+                f"平均コンテキストトークン（概算）: 結合前 {raw:,.0f} → "
+                f"結合後 {packed:,.0f}（{packed / raw:.0%}）"
+            )
     except Exception as e:
         st.error(
             "エラーが発生しました。まず『データ取り込み・同期』ページでインデックスを作成し、環境変数（AWS/Box など）をご確認ください。"
@@ -5,10 +5,20 @@ import streamlit as st
 
 from app.core.config import get_settings
 from app.core.utils import pdf_bytes_to_documents
-from app.core.ingest import upsert_documents, ingest_box_folders, sync_box_folders
+from app.core.ingest import upsert_documents, ingest_box_folders, sync_box_folders, rebuild_shard
+from app.core.shards import (
+    LOCAL_SHARD,
+    evict_shard,
+    get_index_cache,
+    list_shards,
+    shard_dir,
+    sharding_enabled,
+)
+from app.core.warmup import start_warmup
 
 
 st.set_page_config(page_title="データ取り込み・同期", layout="wide")
+start_warmup()
 st.title("データ取り込み・同期")
 st.caption("ローカルPDFの追加、Boxからの取り込み/同期を行います。ベクトル化してFAISSに保存します。")
 
@@ -19,6 +29,13 @@ with st.sidebar:
     st.write(f"TOP_K: {settings.top_k}")
     st.write(f"VECTOR保存先: {settings.vector_dir}")
     st.write("LangSmith: " + ("有効" if (os.getenv("LANGSMITH_TRACING") == "true") else "無効"))
+    st.header("管理者向け")
+    profile_on = st.toggle(
+        "同期のプロファイルを記録",
+        value=settings.profiling,
+        help="同期処理をサンプリングプロファイラで計測し、フレームグラフを保存します"
+        "（要 pyinstrument）。",
+    )
 
 st.subheader("ローカルPDFを追加")
 st.caption("アップロードしたPDFをチャンク分割し、Bedrock Embeddingsでベクトル化してFAISSへ保存します。画像のみのPDF（スキャン等）はテキスト抽出できない場合があります。")
@@ -65,11 +82,98 @@ with col2:
             if not settings.box_folder_ids:
                 st.warning("BOX_FOLDER_IDS が未設定です。")
             else:
-                a, u, d, total = sync_box_folders(settings.box_folder_ids)
+                from app.core.profiling import profile_run
+
+                with profile_run("sync", enabled=profile_on) as prof:
+                    a, u, d, total = sync_box_folders(settings.box_folder_ids)
                 st.success(f"完了: 追加 {a} / 更新 {u} / 削除 {d} 件 / ベクトル総数 {total}")
+                if prof.html_path is not None:
+                    st.caption(f"プロファイル（{prof.elapsed_sec:.1f}s）: {prof.html_path.name}")
+                    st.download_button(
+                        "フレームグラフ（HTML）",
+                        prof.html_path.read_bytes(),
+                        file_name=prof.html_path.name,
+                        mime="text/html",
+                    )
+                    st.download_button(
+                        "speedscope 用 JSON",
+                        prof.speedscope_path.read_bytes(),
+                        file_name=prof.speedscope_path.name,
+                        mime="application/json",
+                    )
+                st.caption("削除・更新前のベクトルは検索から即時に除外されます。墓標が溜まったインデックスはバックグラウンドで圧縮します。")
         except Exception as e:
             st.error("同期に失敗しました。環境変数、アプリ承認、権限をご確認ください。")
             st.exception(e)
 
 st.info("同期は削除も反映します。ファイル数が多い場合は時間がかかることがあります。")
 
+with st.expander("インデックスの圧縮（削除済みベクトルの物理削除）"):
+    from app.core.compaction import compact_index, recent_results, tombstone_stats
+    from app.core.shards import index_dirs
+
+    st.caption(
+        f"墓標の割合が VECTOR_COMPACT_RATIO（{settings.vector_compact_ratio:.0%}）を超えると"
+        "同期後に自動で圧縮します。"
+    )
+    stats = [tombstone_stats(d) for d in index_dirs()]
+    if stats:
+        st.table({
+            "インデックス": [os.path.basename(s["index_dir"]) or s["index_dir"] for s in stats],
+            "ベクトル数": [s["vectors"] for s in stats],
+            "墓標": [s["tombstones"] for s in stats],
+            "割合": [f"{s['ratio']:.1%}" for s in stats],
+            "サイズ(MB)": [f"{s['bytes'] / 1024 / 1024:.1f}" for s in stats],
+        })
+    if st.button("今すぐ圧縮", disabled=not any(s["tombstones"] for s in stats)):
+        try:
+            with st.spinner("圧縮中…"):
+                results = (compact_index(s["index_dir"]) for s in stats if s["tombstones"])
+                done = [r for r in results if r]
+            purged = sum(r.purged for r in done)
+            reclaimed = sum(r.reclaimed_bytes for r in done) / 1024 / 1024
+            st.success(f"圧縮完了: {purged} ベクトルを削除 / {reclaimed:.1f} MB 解放")
+        except Exception as e:
+            st.error("圧縮に失敗しました。")
+            st.exception(e)
+    history = recent_results()
+    if history:
+        st.caption("このプロセスでの圧縮履歴")
+        st.table({
+            "インデックス": [os.path.basename(r.index_dir) for r in history],
+            "削除": [r.purged for r in history],
+            "ベクトル数": [f"{r.vectors_before} → {r.vectors_after}" for r in history],
+            "解放(MB)": [f"{r.reclaimed_bytes / 1024 / 1024:.1f}" for r in history],
+            "所要(秒)": [r.elapsed_sec for r in history],
+        })
+
+if sharding_enabled():
+    st.divider()
+    st.subheader("シャード管理")
+    st.caption(f"VECTOR_SHARDING={settings.vector_sharding}。シャード単位で再構築・メモリ解放ができます。")
+    shard_keys = list_shards()
+    if not shard_keys:
+        st.write("シャードはまだ作成されていません。")
+    else:
+        loaded = set(get_index_cache().loaded())
+        st.table({
+            "シャード": shard_keys,
+            "メモリ上": ["○" if shard_dir(k) in loaded else "-" for k in shard_keys],
+        })
+        sel_shard = st.selectbox("対象シャード", shard_keys)
+        scol1, scol2 = st.columns(2)
+        with scol1:
+            if st.button("シャードを再構築", disabled=sel_shard == LOCAL_SHARD):
+                try:
+                    a, u, d, total = rebuild_shard(sel_shard)
+                    st.success(
+                        f"再構築完了: 追加 {a} / 更新 {u} / 削除 {d} 件 / ベクトル総数 {total}"
+                    )
+                except Exception as e:
+                    st.error("シャードの再構築に失敗しました。")
+                    st.exception(e)
+        with scol2:
+            if st.button("メモリから解放"):
+                evict_shard(sel_shard)
+                st.success(f"{sel_shard} をメモリから解放しました。")
+
@@ -6,7 +6,9 @@ from datetime import datetime
 import streamlit as st
 
 from app.core.config import get_settings
-from app.core.ingest import upload_files_to_box, list_box_items, list_box_pdfs
+from app.core.box_listing import invalidate_listing, list_items, list_items_page, list_pdfs
+from app.core.ingest import upload_files_to_box
+from app.core.warmup import start_warmup
 
 
 def _default_folder_id() -> str:
@@ -37,6 +39,7 @@ def _fmt_time(s: str | None) -> str:
 
 
 st.set_page_config(page_title="Box管理", layout="wide")
+start_warmup()
 st.title("Box 管理")
 st.caption("Boxフォルダの内容を確認し、PDFをアップロードできます。検索への反映は『インデックス管理』ページで実行してください。")
 
@@ -52,6 +55,9 @@ with st.container():
         st.rerun()
     reload_clicked = col3.button("再読み込み")
 
+if reload_clicked and st.session_state.box_folder_id:
+    invalidate_listing(st.session_state.box_folder_id)
+
 tabs = st.tabs(["内容一覧", "PDF一覧", "アップロード"])
 
 with tabs[0]:
@@ -60,8 +66,23 @@ with tabs[0]:
     name_filter = st.text_input("名前でフィルタ", value="")
     type_filter = st.selectbox("種別", ["すべて", "フォルダ", "ファイル"], index=0)
 
+    # ページ位置（フォルダ・表示件数・フィルタが変わったら先頭へ）
+    pager_key = (st.session_state.box_folder_id, page_size, name_filter, type_filter)
+    if st.session_state.get("box_pager_key") != pager_key or reload_clicked:
+        st.session_state.box_pager_key = pager_key
+        st.session_state.box_page = 1
+        st.session_state.box_markers = [None]  # ページ番号 -> Box の marker
+
+    filtered = bool(name_filter) or type_filter != "すべて"
+    next_marker = None
     try:
-        rows = list_box_items(st.session_state.box_folder_id, limit=1000)
+        if filtered:
+            # フィルタ時は全件（キャッシュ）を対象に絞り込み、ローカルでページング
+            rows = list_items(st.session_state.box_folder_id)
+        else:
+            # フィルタなしは表示ページのみをサーバー側ページングで取得
+            marker = st.session_state.box_markers[st.session_state.box_page - 1]
+            rows, next_marker = list_items_page(st.session_state.box_folder_id, page_size, marker)
     except Exception as e:
         st.error("一覧の取得に失敗しました。環境変数とアプリ承認、権限をご確認ください。")
         st.exception(e)
@@ -71,17 +92,31 @@ with tabs[0]:
     total = len(rows)
     folders = sum(1 for r in rows if r.get("type") == "folder")
     files = total - folders
-    pdfs = sum(1 for r in rows if str(r.get("name", ")").lower().endswith(".pdf"))
-    st.caption(f"件数: 合計 {total}（フォルダ {folders} / ファイル {files} / PDF {pdfs}）")
+    pdfs = sum(1 for r in rows if str(r.get("name", "")).lower().endswith(".pdf"))
+    scope = "合計" if filtered else "このページ"
+    st.caption(f"件数: {scope} {total}（フォルダ {folders} / ファイル {files} / PDF {pdfs}）")
 
     # フィルタ
     if name_filter:
-        rows = [r for r in rows if name_filter.lower() in str(r.get("name", ")").lower()]
+        rows = [r for r in rows if name_filter.lower() in str(r.get("name", "")).lower()]
     if type_filter == "フォルダ":
         rows = [r for r in rows if r.get("type") == "folder"]
     elif type_filter == "ファイル":
         rows = [r for r in rows if r.get("type") == "file"]
 
+    if filtered:
+        pages = max(1, math.ceil(len(rows) / page_size))
+        start = (st.session_state.box_page - 1) * page_size
+        rows = rows[start : start + page_size]
+        has_next = st.session_state.box_page < pages
+        page_label = f"ページ {st.session_state.box_page} / {pages}"
+    else:
+        markers = st.session_state.box_markers
+        if next_marker and len(markers) == st.session_state.box_page:
+            markers.append(next_marker)
+        has_next = next_marker is not None
+        page_label = f"ページ {st.session_state.box_page}" + ("" if has_next else "（最終）")
+
     # 整形
     view = [
         {
@@ -94,20 +129,16 @@ with tabs[0]:
         for r in rows
     ]
 
-    # ページング（ローカルスライス）
-    pages = max(1, math.ceil(len(view) / page_size))
-    if "box_page" not in st.session_state:
-        st.session_state.box_page = 1
     colp1, colp2, colp3 = st.columns([1, 2, 1])
     if colp1.button("前へ", disabled=st.session_state.box_page <= 1):
         st.session_state.box_page -= 1
-    colp2.markdown(f"ページ {st.session_state.box_page} / {pages}")
-    if colp3.button("次へ", disabled=st.session_state.box_page >= pages):
+        st.rerun()
+    colp2.markdown(page_label)
+    if colp3.button("次へ", disabled=not has_next):
         st.session_state.box_page += 1
+        st.rerun()
 
-    start = (st.session_state.box_page - 1) * page_size
-    end = start + page_size
-    st.dataframe(view[start:end], use_container_width=True, hide_index=True)
+    st.dataframe(view, use_container_width=True, hide_index=True)
 
     # サブフォルダへ移動
     subfolders = [r for r in rows if r.get("type") == "folder"]
@@ -123,14 +154,14 @@ with tabs[1]:
     recursive = st.checkbox("配下を再帰的に検索", value=False)
     name_filter2 = st.text_input("名前でフィルタ（PDF）", value="")
     try:
-        pdfrows = list_box_pdfs(st.session_state.box_folder_id, recursive=recursive)
+        pdfrows = list_pdfs(st.session_state.box_folder_id, recursive=recursive)
     except Exception as e:
         st.error("PDF一覧の取得に失敗しました。環境変数とアプリ承認、権限をご確認ください。")
         st.exception(e)
         pdfrows = []
 
     if name_filter2:
-        pdfrows = [r for r in pdfrows if name_filter2.lower() in str(r.get("name", ")").lower()]
+        pdfrows = [r for r in pdfrows if name_filter2.lower() in str(r.get("name", "")).lower()]
 
     pdfview = [
         {
@@ -156,14 +187,17 @@ with tabs[2]:
             try:
                 payload = [(f.name, f.read()) for f in files]
                 progress = st.progress(0, text="アップロード中…")
-                # 単純進捗（ベストエフォート）
-                uploaded_ids = []
-                total = len(payload)
-                for i, item in enumerate(payload, start=1):
-                    ids = upload_files_to_box(st.session_state.box_folder_id, [item])
-                    uploaded_ids.extend(ids)
-                    progress.progress(int(i / total * 100))
+
+                def _on_progress(done: int, total: int) -> None:
+                    pct = int(done / total * 100) if total else 100
+                    text = f"アップロード中… {_fmt_size(done)} / {_fmt_size(total)}"
+                    progress.progress(pct, text=text)
+
+                uploaded_ids = upload_files_to_box(
+                    st.session_state.box_folder_id, payload, on_progress=_on_progress
+                )
                 progress.empty()
+                invalidate_listing(st.session_state.box_folder_id)
                 st.success(f"アップロードが完了しました（{len(uploaded_ids)} 件）。")
                 st.caption("ファイルID:")
                 st.write(uploaded_ids)
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import pytest
+
+from app.core.config import get_settings
+
+
+@pytest.fixture(autouse=True)
+def _isolated_settings(tmp_path, monkeypatch):
+    """テストごとに VECTOR_DIR を一時ディレクトリにし、設定キャッシュを破棄する。"""
+    monkeypatch.setenv("VECTOR_DIR", str(tmp_path / "index"))
+    monkeypatch.setenv("VECTOR_SHARDING", "none")
+    get_settings.cache_clear()
+    yield
+    get_settings.cache_clear()
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """Bedrock の代わりに決定的な埋め込みを使う（faiss が無い環境ではスキップ）。"""
+    pytest.importorskip("faiss")
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from app.core import ingest
+
+    embeddings = DeterministicFakeEmbedding(size=8)
+    monkeypatch.setattr(ingest, "get_embeddings", lambda: embeddings)
+    return embeddings
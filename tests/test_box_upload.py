@@ -0,0 +1,219 @@
+"""UploadManager をローカルの偽 Box クライアントで検証する（ネットワーク不要）。"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+from requests_toolbelt.multipart.decoder import MultipartDecoder
+
+from app.core import box_upload
+from app.core.box_upload import UploadManager
+
+PART_SIZE = 4
+
+
+class FakeSession:
+    def __init__(self, box: FakeBox, session_id: str, file_size: int, file_name: str) -> None:
+        self.box = box
+        self.id = session_id
+        self.part_size = PART_SIZE
+        self.file_size = file_size
+        self.file_name = file_name
+        self.parts: Dict[int, Dict[str, Any]] = {}
+        self.data: Dict[int, bytes] = {}
+
+    def get(self) -> FakeSession:
+        return self
+
+    def get_parts(self) -> List[Dict[str, Any]]:
+        return list(self.parts.values())
+
+    def upload_part_bytes(self, part_bytes: bytes, offset: int, total_size: int) -> Dict[str, Any]:
+        with self.box.lock:
+            self.box.part_calls.append(offset)
+            if self.box.fail_parts.get(offset, 0) > 0:
+                self.box.fail_parts[offset] -= 1
+                raise ConnectionError(f"part {offset} failed")
+        part = {
+            "part_id": f"{self.id}-{offset}",
+            "offset": offset,
+            "size": len(part_bytes),
+            "sha1": hashlib.sha1(part_bytes).hexdigest(),
+        }
+        self.parts[offset] = part
+        self.data[offset] = part_bytes
+        return part
+
+    def commit(self, content_sha1: bytes, parts: List[Dict[str, Any]]) -> Any:
+        offsets = [p["offset"] for p in parts]
+        assert offsets == sorted(offsets)
+        content = b"".join(self.data[o] for o in offsets)
+        assert len(content) == self.file_size
+        assert hashlib.sha1(content).digest() == content_sha1
+        return self.box.store(self.file_name, content)
+
+
+class FakeFolder:
+    def __init__(self, box: FakeBox) -> None:
+        self.box = box
+
+    def create_upload_session(self, file_size: int, file_name: str) -> FakeSession:
+        with self.box.lock:
+            session = FakeSession(self.box, f"s{len(self.box.sessions)}", file_size, file_name)
+            self.box.sessions[session.id] = session
+        return session
+
+
+class FakeUploadSession:
+    """/files/content への POST を受け、マルチパート本文を少しずつ読み出す。"""
+
+    api_config = SimpleNamespace(UPLOAD_URL="https://upload.example")
+
+    def __init__(self, box: FakeBox) -> None:
+        self.box = box
+
+    def post(self, url: str, data: Any, headers: Dict[str, str], **_kw: Any) -> Any:
+        assert url == "https://upload.example/files/content"
+        body = b""
+        while chunk := data.read(8):
+            body += chunk
+            if self.box.on_read:
+                self.box.on_read(len(body), data.len)
+        parts = MultipartDecoder(body, headers["Content-Type"]).parts
+        attributes = json.loads(parts[0].content)
+        assert attributes["parent"] == {"id": "0"}
+        file_name = attributes["name"]
+        with self.box.lock:
+            if self.box.fail_streams.get(file_name, 0) > 0:
+                self.box.fail_streams[file_name] -= 1
+                raise ConnectionError(f"{file_name} failed")
+        item = self.box.store(file_name, parts[1].content)
+        return SimpleNamespace(json=lambda: {"entries": [{"type": "file", "id": item.id}]})
+
+
+class FakeBox:
+    """Box API のうち UploadManager が使う部分だけを持つ偽クライアント。"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.files: Dict[str, bytes] = {}
+        self.sessions: Dict[str, FakeSession] = {}
+        self.part_calls: List[int] = []
+        self.fail_parts: Dict[int, int] = {}
+        self.fail_streams: Dict[str, int] = {}
+        self.on_read: Optional[Callable[[int, int], None]] = None
+        self.session = FakeUploadSession(self)
+
+    def store(self, name: str, content: bytes) -> Any:
+        with self.lock:
+            self.files[name] = content
+            return SimpleNamespace(id=f"file-{len(self.files)}")
+
+    def folder(self, folder_id: str) -> FakeFolder:
+        return FakeFolder(self)
+
+    def upload_session(self, session_id: str) -> FakeSession:
+        return self.sessions[session_id]
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch):
+    monkeypatch.setattr(box_upload, "time", SimpleNamespace(sleep=lambda _s: None))
+    box_upload._pending_sessions.clear()
+    yield
+    box_upload._pending_sessions.clear()
+
+
+def _manager(box: FakeBox, max_retries: int = 2, chunk_threshold: int = 10) -> UploadManager:
+    return UploadManager(
+        box,
+        max_workers=3,
+        part_workers=3,
+        chunk_threshold=chunk_threshold,
+        max_retries=max_retries,
+    )
+
+
+def test_small_files_upload_in_parallel_with_progress():
+    box = FakeBox()
+    box.fail_streams["b.pdf"] = 1  # 1回失敗しても再試行で成功する
+    files = [("a.pdf", b"abc"), ("b.pdf", b"defgh"), ("c.pdf", b"ij")]
+    seen: List[tuple] = []
+
+    results = _manager(box).upload("0", files, on_progress=lambda d, t: seen.append((d, t)))
+
+    assert [r.error for r in results] == [None, None, None]
+    assert [r.chunked for r in results] == [False, False, False]
+    assert box.files == dict(files)
+    assert seen[-1] == (10, 10)
+    assert all(d <= t for d, t in seen)
+
+
+def test_small_file_progress_advances_while_body_is_sent():
+    box = FakeBox()
+    halfway, resumed = threading.Event(), threading.Event()
+
+    def _pause_halfway(sent: int, length: int) -> None:
+        if sent * 2 >= length and not halfway.is_set():
+            halfway.set()
+            assert resumed.wait(5)
+
+    def _on_progress(done: int, total: int) -> None:
+        seen.append((done, total))
+        if halfway.is_set() and 0 < done < total:
+            resumed.set()
+
+    box.on_read = _pause_halfway
+    seen: List[tuple] = []
+    data = bytes(range(9)) * 100
+
+    (result,) = _manager(box, max_retries=0, chunk_threshold=1000).upload(
+        "0", [("a.pdf", data)], on_progress=_on_progress, poll_interval=0.01
+    )
+
+    assert result.error is None and box.files["a.pdf"] == data
+    assert resumed.is_set()  # 送信途中の進捗が呼び出し元に届いた
+    assert seen[-1] == (900, 900)
+
+
+def test_chunked_upload_retries_failed_part():
+    box = FakeBox()
+    data = bytes(range(30))  # 30 bytes -> 8 parts of 4 bytes
+    box.fail_parts[8] = 2
+
+    (result,) = _manager(box).upload("0", [("big.pdf", data)])
+
+    assert result.error is None and result.chunked
+    assert box.files["big.pdf"] == data
+    assert box.part_calls.count(8) == 3
+    assert box_upload._pending_sessions == {}
+
+
+def test_chunked_upload_resumes_session_after_failure():
+    box = FakeBox()
+    data = bytes(range(30))
+    box.fail_parts[12] = 5  # 再試行回数を超えて失敗させる
+
+    (first,) = _manager(box, max_retries=1).upload("0", [("big.pdf", data)])
+    assert first.error is not None
+    assert len(box.sessions) == 1 and len(box_upload._pending_sessions) == 1
+    sent_before = set(box.sessions["s0"].parts)
+
+    box.fail_parts.clear()
+    box.part_calls.clear()
+    seen: List[tuple] = []
+    (second,) = _manager(box).upload(
+        "0", [("big.pdf", data)], on_progress=lambda d, t: seen.append((d, t))
+    )
+
+    assert second.error is None
+    assert len(box.sessions) == 1  # 新しいセッションは作らない
+    assert set(box.part_calls) == set(range(0, 30, PART_SIZE)) - sent_before
+    assert box.files["big.pdf"] == data
+    assert seen[-1] == (30, 30)
+    assert box_upload._pending_sessions == {}
@@ -0,0 +1,124 @@
+"""墓標のコンパクション、インデックス書き込みの直列化と読み込み時の整合性。"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from app.core.compaction import compact_index, tombstone_stats
+from app.core.config import get_settings
+from app.core.ingest import load_or_create_index
+from app.core.manifest import Manifest
+from app.core.shards import (
+    IndexCache,
+    index_write_lock,
+    lookup_document,
+    save_index,
+    search_documents,
+)
+
+
+def _docs(prefix: str, n: int):
+    return [
+        Document(page_content=f"{prefix} {i}", metadata={"source": f"{prefix}.pdf"})
+        for i in range(n)
+    ]
+
+
+def test_compaction_purges_tombstoned_vectors(fake_embeddings):
+    from langchain_community.vectorstores import FAISS
+
+    index_dir = get_settings().vector_dir
+    ids = [f"box:1@1:{i}" for i in range(3)] + [f"box:2@1:{i}" for i in range(2)]
+    vs = FAISS.from_documents(_docs("a", 3) + _docs("b", 2), fake_embeddings, ids=ids)
+    vs.save_local(index_dir)
+    with Manifest(index_dir) as manifest:
+        manifest.upsert_file("1", "10", "a.pdf", "fp1", ids[:3], 1)
+        manifest.upsert_file("2", "10", "b.pdf", "fp2", ids[3:], 1)
+        manifest.delete_file("2", 2)
+
+    assert tombstone_stats(index_dir)["tombstones"] == 2
+    assert lookup_document("box:2@1:0") is None  # 墓標付きは即時に除外
+
+    result = compact_index(index_dir)
+
+    assert (result.vectors_before, result.vectors_after, result.purged) == (5, 3, 2)
+    assert tombstone_stats(index_dir)["tombstones"] == 0
+    assert {d.id for d in search_documents("a 0", 5)} == set(ids[:3])
+    assert [p for p in os.listdir(index_dir) if p.startswith(".save-")] == []
+
+
+def test_load_or_create_index_waits_for_write_lock(fake_embeddings):
+    index_dir = get_settings().vector_dir
+    load_or_create_index(_docs("a", 2), index_dir)
+    done = threading.Event()
+
+    def _add() -> None:
+        load_or_create_index(_docs("b", 1), index_dir)
+        done.set()
+
+    with index_write_lock(index_dir):  # コンパクション実行中を模す
+        worker = threading.Thread(target=_add)
+        worker.start()
+        assert not done.wait(0.2)
+    worker.join(5)
+
+    assert done.is_set()
+    assert load_or_create_index(None, index_dir).index.ntotal == 3
+
+
+def _index(embeddings, prefix: str, n: int):
+    from langchain_community.vectorstores import FAISS
+
+    ids = [f"box:{prefix}@1:{i}" for i in range(n)]
+    return FAISS.from_documents(_docs(prefix, n), embeddings, ids=ids)
+
+
+def test_cache_waits_for_half_replaced_index(fake_embeddings):
+    index_dir = get_settings().vector_dir
+    save_index(_index(fake_embeddings, "a", 2), index_dir)
+    staged = tempfile.mkdtemp(dir=index_dir)
+    time.sleep(0.01)
+    _index(fake_embeddings, "b", 3).save_local(staged)
+    # save_index が index.faiss だけ置き換えた瞬間を再現し、少し遅れて index.pkl を置き換える
+    os.replace(os.path.join(staged, "index.faiss"), os.path.join(index_dir, "index.faiss"))
+    finish = threading.Timer(
+        0.1,
+        os.replace,
+        (os.path.join(staged, "index.pkl"), os.path.join(index_dir, "index.pkl")),
+    )
+    finish.start()
+
+    vs = IndexCache().get(index_dir)
+    finish.join()
+
+    assert vs is not None and vs.index.ntotal == 3
+    assert sorted(vs.index_to_docstore_id.values()) == [f"box:b@1:{i}" for i in range(3)]
+
+
+def test_cache_reloads_when_index_is_saved_during_load(fake_embeddings, monkeypatch):
+    from langchain_community.vectorstores import FAISS
+
+    index_dir = get_settings().vector_dir
+    save_index(_index(fake_embeddings, "a", 2), index_dir)
+    load_local = FAISS.load_local
+    loads = []
+
+    def _load_then_save(*args, **kwargs):
+        vs = load_local(*args, **kwargs)
+        if not loads:  # 1回目のロード直後に別プロセスが保存したことにする
+            time.sleep(0.01)
+            save_index(_index(fake_embeddings, "b", 3), index_dir)
+        loads.append(vs.index.ntotal)
+        return vs
+
+    monkeypatch.setattr(FAISS, "load_local", _load_then_save)
+
+    vs = IndexCache().get(index_dir)
+
+    assert loads == [2, 3]
+    assert vs is not None and vs.index.ntotal == 3
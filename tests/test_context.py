@@ -0,0 +1,84 @@
+"""検索結果の結合・重複除去（pack_context）。"""
+
+from __future__ import annotations
+
+from typing import Dict, Optional
+
+from langchain_core.documents import Document
+
+from app.core.config import get_settings
+from app.core.context import merge_overlapping, pack_context
+
+BODY = "".join(f"第{i}条 本規程の{i}番目の定め。" for i in range(1, 9))
+
+
+def _doc(text: str, vid: Optional[str], source: str = "規程.pdf", page: int = 1, idx: int = 0):
+    return Document(
+        page_content=text, id=vid, metadata={"source": source, "page": page, "chunk_index": idx}
+    )
+
+
+def test_merge_overlapping():
+    assert merge_overlapping(BODY[:60], BODY[30:]) == BODY
+    assert merge_overlapping(BODY, BODY[10:40]) == BODY
+    assert merge_overlapping(BODY[:30], BODY[40:]) is None
+    assert merge_overlapping(BODY[:30], BODY[20:]) is None  # 重なりが短すぎる
+
+
+def test_adjacent_chunks_of_same_file_are_merged_once():
+    first, second = BODY[:60], BODY[40:]
+    docs = [_doc(second, "box:111@1:1", idx=1), _doc(first, "box:111@1:0", idx=0)]
+
+    context = pack_context(docs, budget=0)
+
+    assert context == f"[source:規程.pdf page:1]\n{BODY}"
+
+
+def test_same_name_in_different_box_files_is_not_merged():
+    docs = [
+        _doc(BODY[:60], "box:111@1:0", idx=0),
+        _doc(BODY[40:], "box:222@1:1", idx=1),
+    ]
+
+    context = pack_context(docs, budget=0)
+
+    assert context.count("[source:規程.pdf page:1]") == 2
+    header = "[source:規程.pdf page:1]\n"
+    assert context == f"{header}{BODY[:60]}\n\n{header}{BODY[40:]}"
+
+
+def test_non_box_documents_fall_back_to_source():
+    docs = [_doc(BODY[:60], None, idx=0), _doc(BODY[40:], None, idx=1)]
+
+    assert pack_context(docs, budget=0) == f"[source:規程.pdf page:1]\n{BODY}"
+
+
+def test_budget_keeps_spans_in_rank_order_and_expands_neighbors():
+    store: Dict[str, Document] = {
+        "box:111@1:0": _doc("前文" * 30, "box:111@1:0", idx=0),
+        "box:111@1:1": _doc("本文" * 30, "box:111@1:1", idx=1),
+        "box:111@1:2": _doc("後文" * 30, "box:111@1:2", idx=2),
+    }
+    hit = store["box:111@1:1"]
+    other = _doc("別紙" * 30, "box:333@1:0", source="別紙.pdf", idx=0)
+
+    narrow = pack_context([hit, other], budget=100)
+    assert narrow.startswith("[source:規程.pdf page:1]\n" + "本文" * 30)
+    assert "別紙" not in narrow
+
+    wide = pack_context([hit], budget=0, expand_neighbors=True, lookup=store.get)
+    assert wide == "[source:規程.pdf page:1]\n" + "\n".join(
+        ["前文" * 30, "本文" * 30, "後文" * 30]
+    )
+
+
+def test_default_budget_keeps_all_top_k_japanese_chunks():
+    settings = get_settings()
+    docs = [
+        _doc(chr(0x3042 + i) * 800, f"box:{i}@1:0", source=f"{i}.pdf")
+        for i in range(settings.top_k)
+    ]
+
+    context = pack_context(docs, budget=settings.context_token_budget)
+
+    assert context.count("[source:") == settings.top_k
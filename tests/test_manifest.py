@@ -0,0 +1,74 @@
+"""旧形式 box_manifest.json から SQLite マニフェストへの移行。"""
+
+from __future__ import annotations
+
+import json
+
+from app.core.manifest import LEGACY_MANIFEST_JSON, Manifest
+
+LEGACY = {
+    "111": {
+        "folder_id": "10",
+        "name": "a.pdf",
+        "fingerprint": "sha1:aaa",
+        "vector_ids": ["box:111:0", "box:111:1", "box:111:2"],
+    },
+    "222": {
+        "folder_id": "20",
+        "name": "b.pdf",
+        "fingerprint": "sha1:bbb",
+        "vector_ids": ["box:222:0"],
+    },
+}
+
+
+def _write_legacy(vector_dir, data=LEGACY):
+    vector_dir.mkdir(parents=True, exist_ok=True)
+    path = vector_dir / LEGACY_MANIFEST_JSON
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return path
+
+
+def test_migrates_legacy_json_on_first_open(tmp_path):
+    legacy = _write_legacy(tmp_path)
+
+    with Manifest(str(tmp_path)) as manifest:
+        assert manifest.fingerprints() == {"111": "sha1:aaa", "222": "sha1:bbb"}
+        assert manifest.vector_ids("111") == ["box:111:0", "box:111:1", "box:111:2"]
+        assert [f["name"] for f in manifest.files_by_folder("20")] == ["b.pdf"]
+        assert manifest.chunk_count() == 4
+        assert manifest.generation() == 0
+        assert manifest.tombstones() == []
+
+    assert not legacy.exists()
+    assert (tmp_path / (LEGACY_MANIFEST_JSON + ".migrated")).exists()
+
+
+def test_migrated_file_can_be_updated_and_tombstoned(tmp_path):
+    _write_legacy(tmp_path)
+
+    with Manifest(str(tmp_path)) as manifest:
+        gen = manifest.bump_generation()
+        manifest.upsert_file("111", "10", "a.pdf", "sha1:new", ["box:111@1:0"], gen)
+        assert manifest.vector_ids("111") == ["box:111@1:0"]
+        assert sorted(manifest.tombstones()) == ["box:111:0", "box:111:1", "box:111:2"]
+
+
+def test_does_not_migrate_over_existing_rows(tmp_path):
+    with Manifest(str(tmp_path)) as manifest:
+        manifest.upsert_file("999", "10", "z.pdf", "sha1:zzz", ["box:999@0:0"], 0)
+    legacy = _write_legacy(tmp_path)
+
+    with Manifest(str(tmp_path)) as manifest:
+        assert manifest.fingerprints() == {"999": "sha1:zzz"}
+    assert legacy.exists()
+
+
+def test_unreadable_legacy_json_is_left_in_place(tmp_path):
+    tmp_path.mkdir(exist_ok=True)
+    legacy = tmp_path / LEGACY_MANIFEST_JSON
+    legacy.write_text("{not json", encoding="utf-8")
+
+    with Manifest(str(tmp_path)) as manifest:
+        assert manifest.file_count() == 0
+    assert legacy.exists()
@@ -0,0 +1,77 @@
+"""プロファイル記録（検索が呼び出し元スレッドで実行され、フレームグラフに現れること）。"""
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+
+from app.core import rag, shards
+from app.core.config import get_settings
+from app.core.profiling import profile_run, profiling_active
+
+
+@pytest.fixture
+def sharded_chain(fake_embeddings, tmp_path, monkeypatch):
+    """2シャードのインデックスと固定応答の LLM で build_chain() を組み立てる。"""
+    from langchain_community.vectorstores import FAISS
+
+    monkeypatch.setenv("VECTOR_SHARDING", "hash")
+    monkeypatch.setenv("PROFILES_DIR", str(tmp_path / "profiles"))
+    get_settings.cache_clear()
+    for key in ("h000", "h001"):
+        docs = [Document(page_content=f"{key} 本文", metadata={"source": f"{key}.pdf"})]
+        FAISS.from_documents(docs, fake_embeddings, ids=[f"box:{key}@1:0"]).save_local(
+            shards.shard_dir(key)
+        )
+
+    threads = []
+    search_one = shards._search_batch_one
+
+    def _traced_shard_search(index_dir, embeddings, k):
+        threads.append(threading.get_ident())
+        time.sleep(0.05)  # サンプリングで確実に拾えるだけの時間をかける
+        return search_one(index_dir, embeddings, k)
+
+    monkeypatch.setattr(shards, "_search_batch_one", _traced_shard_search)
+    monkeypatch.setattr(rag, "get_llm", lambda: FakeListChatModel(responses=["回答"]))
+    return rag.build_chain(), threads
+
+
+def test_profiled_retrieval_runs_on_calling_thread(sharded_chain):
+    chain, threads = sharded_chain
+
+    with profile_run("qa", enabled=True) as run:
+        assert profiling_active()
+        assert chain.invoke("本文") == "回答"
+
+    assert not profiling_active()
+    assert threads == [threading.get_ident()] * 2
+    assert run.html_path is not None and run.html_path.exists()
+    assert "_traced_shard_search" in run.speedscope_path.read_text(encoding="utf-8")
+
+
+def test_unprofiled_retrieval_fans_out_to_worker_threads(sharded_chain):
+    chain, threads = sharded_chain
+
+    with profile_run("qa", enabled=False) as run:
+        assert not profiling_active()
+        chain.invoke("本文")
+
+    assert run.html_path is None
+    assert len(threads) == 2 and threading.get_ident() not in threads
+
+
+def test_missing_pyinstrument_runs_unprofiled(monkeypatch, caplog):
+    monkeypatch.setitem(sys.modules, "pyinstrument", None)
+    ran = False
+
+    with caplog.at_level("WARNING"), profile_run("sync", enabled=True) as run:
+        ran = True
+
+    assert ran and run.html_path is None
+    assert "pyinstrument" in caplog.text
@@ -0,0 +1,109 @@
+"""検索サーバ（マイクロバッチ、k ごとの切り出し、Unix ソケット越しの往復）。"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import pytest
+from langchain_core.documents import Document
+
+from app.core import ingest, retrieval_server, shards
+from app.core.config import get_settings
+from app.core.retrieval_server import RetrievalClient
+
+CLIENTS = 4
+
+
+def _embed(text: str) -> List[float]:
+    return [float(ord(c)) for c in text]
+
+
+def _text(vector: List[float]) -> str:
+    return "".join(chr(int(v)) for v in vector)
+
+
+@pytest.fixture
+def batches(monkeypatch) -> List[List[str]]:
+    """埋め込みと検索を差し替え、search_batch_by_vectors に渡ったクエリを記録する。"""
+    calls: List[List[str]] = []
+
+    def _search(vectors: List[List[float]], k: int) -> List[List[Tuple[Document, float]]]:
+        queries = [_text(v) for v in vectors]
+        calls.append(queries)
+        return [
+            [(Document(page_content=f"{q}-{i}", id=f"box:{q}@1:{i}"), float(i)) for i in range(k)]
+            for q in queries
+        ]
+
+    monkeypatch.setattr(ingest, "get_embeddings", lambda: SimpleNamespace(embed_query=_embed))
+    monkeypatch.setattr(shards, "search_batch_by_vectors", _search)
+    return calls
+
+
+@pytest.fixture
+def client(batches, tmp_path, monkeypatch):
+    """Unix ソケットで serve() をスレッド起動し、つながったクライアントを返す。"""
+    monkeypatch.setenv("RETRIEVAL_BATCH_WINDOW_MS", "2000")  # 全員そろうまで待つ
+    monkeypatch.setenv("RETRIEVAL_BATCH_MAX", str(CLIENTS))
+    get_settings.cache_clear()
+    servers = []
+
+    class _Recorded(retrieval_server._ThreadingUnixHTTPServer):
+        def server_activate(self) -> None:
+            super().server_activate()
+            servers.append(self)
+
+    monkeypatch.setattr(retrieval_server, "_ThreadingUnixHTTPServer", _Recorded)
+    path = str(tmp_path / "retrieval.sock")
+    thread = threading.Thread(target=retrieval_server.serve, kwargs={"socket_path": path})
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not servers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert servers, "検索サーバが起動しなかった"
+    yield RetrievalClient(f"unix://{path}")
+    servers[0].shutdown()
+    thread.join(5)
+    assert not os.path.exists(path)
+
+
+def test_concurrent_searches_share_one_batch(client, batches):
+    queries = [f"q{i}" for i in range(CLIENTS)]
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        results = list(pool.map(lambda q: client.search_documents(q, 2), queries))
+
+    assert len(batches) == 1 and sorted(batches[0]) == queries
+    assert [[d.page_content for d in docs] for docs in results] == [
+        [f"{q}-0", f"{q}-1"] for q in queries
+    ]
+
+
+def test_results_are_cut_to_each_query_k(client, batches):
+    ks = [1, 3, 2, 5]
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        results = list(pool.map(lambda k: client.search_with_scores(f"k{k}", k), ks))
+
+    assert len(batches) == 1
+    assert [len(hits) for hits in results] == ks
+    assert [score for _, score in results[1]] == [0.0, 1.0, 2.0]
+
+
+def test_document_lookup_round_trip(client, monkeypatch):
+    stored = Document(page_content="本文", metadata={"source": "規程.pdf"}, id="box:1@2:3")
+    monkeypatch.setattr(
+        shards, "lookup_document", lambda doc_id: stored if doc_id == stored.id else None
+    )
+
+    doc = client.lookup_document("box:1@2:3")
+
+    assert doc is not None
+    assert (doc.id, doc.page_content, doc.metadata) == (stored.id, "本文", {"source": "規程.pdf"})
+    assert client.lookup_document("box:9@1:0") is None
+    assert client.health()["status"] == "ok"
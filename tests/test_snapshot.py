@@ -0,0 +1,143 @@
+"""スナップショットの完全/差分エクスポートとインポート（再埋め込みなし）。"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+from langchain_core.documents import Document
+
+from app.core import ingest
+from app.core.config import get_settings
+from app.core.manifest import Manifest
+from app.core.shards import index_dirs, search_documents, shard_dir, shard_key_for_file
+from app.core.snapshot import export_snapshot, import_snapshot
+
+
+class FakeBox:
+    """file(file_id).content() だけを持つ Box クライアント。本文は files[file_id]。"""
+
+    def __init__(self) -> None:
+        self.files: Dict[str, str] = {}
+
+    def file(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(content=lambda: self.files[file_id].encode("utf-8"))
+
+
+def _split(name: str, data: bytes) -> List[Document]:
+    return [
+        Document(page_content=line, metadata={"source": name, "page": 1, "chunk_index": i})
+        for i, line in enumerate(data.decode("utf-8").splitlines())
+    ]
+
+
+@pytest.fixture
+def box(fake_embeddings, monkeypatch):
+    monkeypatch.setattr(ingest, "pdf_bytes_to_documents", _split)
+    return FakeBox()
+
+
+def _use(monkeypatch, vector_dir: Path) -> None:
+    monkeypatch.setenv("VECTOR_DIR", str(vector_dir))
+    get_settings.cache_clear()
+
+
+def _sync(box: FakeBox, index_dir: str, files: Dict[str, str]) -> None:
+    """files（file_id -> 本文）を Box の現状として index_dir に同期する。"""
+    box.files.update(files)
+    current = {
+        fid: {"id": fid, "name": f"{fid}.pdf", "sha1": text, "folder_id": "10"}
+        for fid, text in files.items()
+    }
+    ingest._sync_index(box, index_dir, current)
+
+
+def _contents() -> List[str]:
+    return sorted(d.page_content for d in search_documents("x", 100))
+
+
+def test_full_then_delta_round_trip(box, tmp_path, monkeypatch):
+    source, target = tmp_path / "source", tmp_path / "target"
+    _use(monkeypatch, source)
+    _sync(box, str(source), {"1": "a0\na1\na2", "2": "b0\nb1"})
+    full = str(tmp_path / "full.tar")
+    meta = export_snapshot(full, dtype="float16")
+    assert meta["kind"] == "full" and meta["indexes"][0]["count"] == 5
+
+    _use(monkeypatch, target)
+    summary = import_snapshot(full)
+    assert summary["indexes"][0]["total_vectors"] == 5
+    assert _contents() == ["a0", "a1", "a2", "b0", "b1"]
+
+    # 1 を更新・2 を削除・3 を追加して差分を作る
+    _use(monkeypatch, source)
+    _sync(box, str(source), {"1": "a0\nA1", "3": "c0"})
+    delta = str(tmp_path / "delta.tar")
+    meta = export_snapshot(delta, base=full)
+    entry = meta["indexes"][0]
+    assert meta["kind"] == entry["kind"] == "delta"
+    assert (entry["count"], entry["deleted"]) == (3, 5)
+
+    _use(monkeypatch, target)
+    import_snapshot(delta)
+    assert _contents() == ["A1", "a0", "c0"]
+    with Manifest(str(target)) as manifest:
+        assert manifest.generation() == 2
+        assert manifest.tombstones() == []
+        assert sorted(manifest.fingerprints()) == ["1", "3"]
+
+
+def test_import_requires_checksum_sidecar(box, tmp_path, monkeypatch):
+    _use(monkeypatch, tmp_path / "source")
+    _sync(box, get_settings().vector_dir, {"1": "a0"})
+    path = tmp_path / "full.tar"
+    export_snapshot(str(path))
+
+    Path(f"{path}.sha256").unlink()
+    _use(monkeypatch, tmp_path / "target")
+    with pytest.raises(RuntimeError, match="チェックサムファイル"):
+        import_snapshot(str(path))
+
+    Path(f"{path}.sha256").write_text("0" * 64 + "  full.tar\n", encoding="utf-8")
+    with pytest.raises(RuntimeError, match="一致しません"):
+        import_snapshot(str(path))
+
+
+def test_sharded_since_and_full_import_removes_missing_shards(box, tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_SHARDING", "folder")
+    source, target = tmp_path / "source", tmp_path / "target"
+    _use(monkeypatch, source)
+    old, busy = shard_dir(shard_key_for_file("10", "")), shard_dir(shard_key_for_file("20", ""))
+    _sync(box, old, {"1": "a0"})  # 世代 1
+    for n in range(3):  # 世代 1..3
+        _sync(box, busy, {"2": f"b{n}"})
+
+    _use(monkeypatch, target)
+    stale = shard_dir(shard_key_for_file("30", ""))
+    _sync(box, stale, {"9": "z0"})
+    assert len(index_dirs()) == 1
+
+    _use(monkeypatch, source)
+    full = str(tmp_path / "full.tar")
+    export_snapshot(full)
+    _use(monkeypatch, target)
+    summary = import_snapshot(full)
+    assert summary["removed"] == [Path(stale).relative_to(target).as_posix()]
+    assert _contents() == ["a0", "b2"]
+
+    # 世代 2 より後の差分: 世代 1 のままのシャードは空の差分になる
+    _use(monkeypatch, source)
+    _sync(box, busy, {"2": "b3"})
+    delta = str(tmp_path / "delta.tar")
+    meta = export_snapshot(delta, since=2)
+    by_name = {Path(e["name"]).name: e for e in meta["indexes"]}
+    quiet = by_name["f10"]
+    assert (quiet["since"], quiet["count"], quiet["deleted"]) == (1, 0, 0)
+    assert (by_name["f20"]["since"], by_name["f20"]["count"]) == (2, 1)
+
+    _use(monkeypatch, target)
+    summary = import_snapshot(delta)
+    assert summary["removed"] == []
+    assert _contents() == ["a0", "b3"]
@@ -0,0 +1,73 @@
+"""Box 同期（フォルダ単位シャードでの削除反映）。"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+from langchain_core.documents import Document
+
+from app.core import ingest
+from app.core.config import get_settings
+from app.core.manifest import Manifest
+from app.core.shards import list_shards, search_documents, shard_dir
+
+
+class FakeBox:
+    """folder(...).get_items() と file(...).content() だけを持つ Box クライアント。"""
+
+    def __init__(self, tree: Dict[str, Dict[str, str]]) -> None:
+        self.tree = tree  # folder_id -> {file_id: 本文}
+
+    def folder(self, folder_id: str) -> SimpleNamespace:
+        items = [
+            SimpleNamespace(type="file", id=fid, name=f"{fid}.pdf", sha1=text)
+            for fid, text in self.tree[folder_id].items()
+        ]
+        return SimpleNamespace(get_items=lambda **_kw: items)
+
+    def file(self, file_id: str) -> SimpleNamespace:
+        text = next(files[file_id] for files in self.tree.values() if file_id in files)
+        return SimpleNamespace(content=lambda: text.encode("utf-8"))
+
+
+def _split(name: str, data: bytes) -> List[Document]:
+    return [
+        Document(page_content=line, metadata={"source": name, "page": 1, "chunk_index": i})
+        for i, line in enumerate(data.decode("utf-8").splitlines())
+    ]
+
+
+@pytest.fixture
+def box(fake_embeddings, monkeypatch):
+    monkeypatch.setenv("VECTOR_SHARDING", "folder")
+    monkeypatch.setenv("VECTOR_COMPACT_RATIO", "0")  # バックグラウンドの圧縮は起動しない
+    get_settings.cache_clear()
+    client = FakeBox({"100": {"1": "a0\na1"}, "200": {"2": "b0"}})
+    monkeypatch.setattr(ingest, "get_box_client", lambda: client)
+    monkeypatch.setattr(ingest, "pdf_bytes_to_documents", _split)
+    return client
+
+
+def test_folder_removed_from_list_is_tombstoned(box):
+    assert ingest.sync_box_folders("100,200") == (2, 0, 0, 3)
+    assert list_shards() == ["f100", "f200"]
+
+    added, updated, deleted, total = ingest.sync_box_folders("100")
+
+    assert (added, updated, deleted) == (0, 0, 1)
+    with Manifest(shard_dir("f200")) as manifest:
+        assert manifest.fingerprints() == {}
+        assert sorted(manifest.tombstones()) == ["box:2@1:0"]
+    assert sorted(d.page_content for d in search_documents("x", 10)) == ["a0", "a1"]
+
+
+def test_noop_sync_does_not_load_indexes(box, monkeypatch):
+    ingest.sync_box_folders("100,200")
+
+    def _no_load(_vector_dir):
+        raise AssertionError("変更がないのにインデックスをロードした")
+
+    monkeypatch.setattr(ingest, "_load_index_if_exists", _no_load)
+    assert ingest.sync_box_folders("100,200") == (0, 0, 0, 3)